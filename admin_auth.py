@@ -0,0 +1,112 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+import metadata_store
+from utils import write_json_atomic
+
+
+AUTH_FILE = os.environ.get(
+    "ADMIN_AUTH_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "admin_auth.json")
+)
+# bcrypt runs in this many worker processes, so a burst of logins queues
+# there instead of pinning every request worker.
+AUTH_WORKERS = int(os.environ.get("AUTH_WORKERS", "2"))
+LOGIN_MAX_ATTEMPTS = int(os.environ.get("LOGIN_MAX_ATTEMPTS", "5"))
+LOGIN_WINDOW_SECONDS = float(os.environ.get("LOGIN_WINDOW_SECONDS", "300"))
+
+# Failed-login counters live in the shared database so every gunicorn worker
+# enforces the same limit; rows older than the window are pruned.
+metadata_store.register_schema("""
+CREATE TABLE IF NOT EXISTS login_attempts (
+    client TEXT NOT NULL,
+    attempted_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS login_attempts_client ON login_attempts (client, attempted_at);
+CREATE INDEX IF NOT EXISTS login_attempts_time ON login_attempts (attempted_at);
+""")
+
+_lock = threading.Lock()
+_pool = None
+_hash_cache = {"mtime": None, "hash": None}
+
+
+def _check(password, hashed):
+    return bcrypt.checkpw(password.encode(), hashed.encode())
+
+
+def _hash(password):
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+
+
+def _get_pool():
+    # Created lazily so each gunicorn worker gets its own pool after fork
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=AUTH_WORKERS)
+        return _pool
+
+
+def _run(fn, *args):
+    global _pool
+    try:
+        return _get_pool().submit(fn, *args).result()
+    except (OSError, RuntimeError):
+        # No subprocesses available (sandboxed or broken pool): hash inline
+        with _lock:
+            _pool = None
+        return fn(*args)
+
+
+def load_hash():
+    try:
+        mtime = os.stat(AUTH_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _lock:
+        if _hash_cache["mtime"] != mtime:
+            with open(AUTH_FILE, "r") as f:
+                _hash_cache["hash"] = json.load(f).get("password", "")
+            _hash_cache["mtime"] = mtime
+        return _hash_cache["hash"]
+
+
+def has_password():
+    return os.path.exists(AUTH_FILE)
+
+
+def set_password(password):
+    write_json_atomic(AUTH_FILE, {"password": _run(_hash, password)})
+
+
+def retry_after(client):
+    # Seconds until this client may try again, 0 if not throttled
+    now = time.time()
+    row = metadata_store.connect().execute(
+        "SELECT COUNT(*) AS n, MIN(attempted_at) AS first FROM login_attempts WHERE client = ? AND attempted_at > ?",
+        (client, now - LOGIN_WINDOW_SECONDS)
+    ).fetchone()
+    if row["n"] < LOGIN_MAX_ATTEMPTS:
+        return 0
+    return LOGIN_WINDOW_SECONDS - (now - row["first"])
+
+
+def verify_password(password, client):
+    stored = load_hash()
+    if not stored:
+        return False
+    now = time.time()
+    with metadata_store.transaction() as conn:
+        conn.execute("DELETE FROM login_attempts WHERE attempted_at <= ?", (now - LOGIN_WINDOW_SECONDS,))
+        conn.execute("INSERT INTO login_attempts (client, attempted_at) VALUES (?, ?)", (client, now))
+    ok = _run(_check, password, stored)
+    if ok:
+        with metadata_store.transaction() as conn:
+            conn.execute("DELETE FROM login_attempts WHERE client = ?", (client,))
+    return ok
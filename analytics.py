@@ -0,0 +1,214 @@
+import json
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import sheet_mirror
+from submissions import (
+    SLOT_HEADER, STATUS_HEADER, TIMESTAMP_FORMAT, TIMESTAMP_HEADER, normalize_slot, normalize_status
+)
+
+
+# Bookings later than this after launch share the last hourly bucket
+ANALYTICS_MAX_HOURS = 24 * 14
+ACTIVE, CANCELLED, DUPLICATE = 0, 1, 2
+_STATUS_CODES = {"cancelled": CANCELLED, "duplicate": DUPLICATE}
+
+# Results are reused until the mirror revision for the sheet moves
+_cache_lock = threading.Lock()
+_result_cache = {}
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _parse_fallback(values):
+    parsed = np.full(len(values), np.nan)
+    for i, value in enumerate(values):
+        try:
+            parsed[i] = (datetime.strptime(value.strip(), TIMESTAMP_FORMAT) - _EPOCH).total_seconds()
+        except ValueError:
+            pass
+    return parsed
+
+
+def parse_timestamps(values):
+    # "dd/mm/YYYY HH:MM:SS" to seconds (naive local time; only differences
+    # are used). Fixed-width values are reordered into ISO form as a
+    # character matrix and converted in one go; anything else, like
+    # unpadded days, goes through strptime.
+    text = np.asarray(values, dtype=str)
+    seconds = np.full(len(text), np.nan)
+    fixed = np.char.str_len(text) == 19 if len(text) else np.zeros(0, dtype=bool)
+    if fixed.any():
+        chars = text[fixed].astype("U19").view("U1").reshape(-1, 19)
+        digits = np.char.isdigit(chars[:, [0, 1, 3, 4, 6, 7, 8, 9, 11, 12, 14, 15, 17, 18]]).all(axis=1)
+        separators = (
+            (chars[:, 2] == "/") & (chars[:, 5] == "/") & (chars[:, 10] == " ")
+            & (chars[:, 13] == ":") & (chars[:, 16] == ":")
+        )
+        well_formed = digits & separators
+        iso = np.empty((len(chars), 19), dtype="U1")
+        iso[:, 0:4] = chars[:, 6:10]
+        iso[:, 4] = "-"
+        iso[:, 5:7] = chars[:, 3:5]
+        iso[:, 7] = "-"
+        iso[:, 8:10] = chars[:, 0:2]
+        iso[:, 10] = "T"
+        iso[:, 11:19] = chars[:, 11:19]
+        iso_text = iso[well_formed].copy().view("U19").ravel()
+        positions = np.flatnonzero(fixed)[well_formed]
+        try:
+            seconds[positions] = iso_text.astype("datetime64[s]").astype(np.int64)
+        except ValueError:
+            # An impossible date (month 13...) somewhere: parse these one by one
+            seconds[positions] = _parse_fallback(list(text[positions]))
+    rest = np.flatnonzero(~fixed)
+    if len(rest):
+        seconds[rest] = _parse_fallback(list(text[rest]))
+    return seconds
+
+
+def _codes(raw, normalize):
+    # Normalize each distinct value once, then map every row by index
+    distinct, inverse = np.unique(np.asarray(raw, dtype=str), return_inverse=True)
+    normalized = [normalize(value) for value in distinct]
+    names = sorted(set(normalized))
+    lookup = np.array([names.index(value) for value in normalized], dtype=np.int64)
+    return names, lookup[inverse] if len(inverse) else np.zeros(0, dtype=np.int64)
+
+
+def load_columns(state, sheet_id):
+    headers = state["headers"]
+    slot_col = headers.index(SLOT_HEADER) if SLOT_HEADER in headers else -1
+    status_col = headers.index(STATUS_HEADER) if STATUS_HEADER in headers else -1
+    time_col = headers.index(TIMESTAMP_HEADER) if TIMESTAMP_HEADER in headers else -1
+
+    slots, statuses, times = [], [], []
+    for _, cells in sheet_mirror.iter_rows(sheet_id):
+        width = len(cells)
+        slots.append(cells[slot_col] if 0 <= slot_col < width else "")
+        statuses.append(cells[status_col] if 0 <= status_col < width else "")
+        times.append(cells[time_col] if 0 <= time_col < width else "")
+
+    slot_names, slot_codes = _codes(slots, normalize_slot)
+    status_names, status_codes = _codes(statuses, normalize_status)
+    status_lookup = np.array([_STATUS_CODES.get(name, ACTIVE) for name in status_names], dtype=np.int8)
+    return {
+        "slot_names": slot_names,
+        "slot": slot_codes,
+        "status": status_lookup[status_codes] if len(status_codes) else np.zeros(0, dtype=np.int8),
+        "time": parse_timestamps(times),
+    }
+
+
+def _rate(part, whole):
+    return round(float(part) / whole, 4) if whole else None
+
+
+def compute(columns, form_slots):
+    names = columns["slot_names"]
+    slot, status, times = columns["slot"], columns["status"], columns["time"]
+    width = len(names)
+    total = np.bincount(slot, minlength=width)
+    active = np.bincount(slot[status == ACTIVE], minlength=width)
+    cancelled = np.bincount(slot[status == CANCELLED], minlength=width)
+    duplicate = np.bincount(slot[status == DUPLICATE], minlength=width)
+
+    # Active bookings ordered by slot, then time: the n-th booking of a slot
+    # is at starts[slot] + n - 1.
+    timed = (status == ACTIVE) & ~np.isnan(times)
+    timed_slot, timed_time = slot[timed], times[timed]
+    order = np.lexsort((timed_time, timed_slot))
+    timed_slot, timed_time = timed_slot[order], timed_time[order]
+    starts = np.searchsorted(timed_slot, np.arange(width))
+    timed_count = np.bincount(timed_slot, minlength=width)
+
+    known = times[~np.isnan(times)]
+    launch = float(known.min()) if len(known) else None
+    hourly = []
+    if launch is not None and len(timed_time):
+        hours = np.minimum((timed_time - launch) // 3600, ANALYTICS_MAX_HOURS - 1).astype(np.int64)
+        hourly = np.bincount(hours).tolist()
+
+    slots = []
+    for form_slot in form_slots:
+        limit = int(form_slot["limit"])
+        code = names.index(form_slot["name"]) if form_slot["name"] in names else None
+        booked = int(active[code]) if code is not None else 0
+        seen = int(total[code]) if code is not None else 0
+        time_to_fill = None
+        if code is not None and limit > 0 and timed_count[code] >= limit:
+            filled_at = timed_time[starts[code] + limit - 1]
+            time_to_fill = round((filled_at - launch) / 3600, 2)
+        slots.append({
+            "name": form_slot["name"],
+            "limit": limit,
+            "booked": booked,
+            "fill_rate": _rate(booked, limit),
+            "submissions": seen,
+            "cancellation_rate": _rate(cancelled[code], seen) if code is not None else None,
+            "duplicate_rate": _rate(duplicate[code], seen) if code is not None else None,
+            "time_to_fill_hours": time_to_fill,
+        })
+
+    rows = len(slot)
+    return {
+        "submissions": rows,
+        "active": int(active.sum()),
+        "cancellation_rate": _rate(cancelled.sum(), rows),
+        "duplicate_rate": _rate(duplicate.sum(), rows),
+        "cancelled": int(cancelled.sum()),
+        "duplicates": int(duplicate.sum()),
+        "launched_at": (_EPOCH + timedelta(seconds=launch)).strftime("%Y-%m-%d %H:%M") if launch is not None else None,
+        "bookings_per_hour": hourly,
+        "slots": slots,
+    }
+
+
+def form_analytics(form, sheet_id, state):
+    key = json.dumps([[s["name"], s["limit"]] for s in form["slots"]])
+    with _cache_lock:
+        cached = _result_cache.get(sheet_id)
+    if cached and cached[0] == state["revision"] and cached[1] == key:
+        result = cached[2]
+    else:
+        result = compute(load_columns(state, sheet_id), form["slots"])
+        with _cache_lock:
+            _result_cache[sheet_id] = (state["revision"], key, result)
+    return dict(result, form_id=form["form_id"], class_name=form["class_name"])
+
+
+def summarize(results):
+    # The same slot name across classes (e.g. "Monday 10am"), for sizing
+    by_name = {}
+    for result in results:
+        for slot in result["slots"]:
+            entry = by_name.setdefault(slot["name"], {"name": slot["name"], "classes": 0, "booked": 0,
+                                                      "limit": 0, "filled": 0, "fill_hours": []})
+            entry["classes"] += 1
+            entry["booked"] += slot["booked"]
+            entry["limit"] += slot["limit"]
+            if slot["time_to_fill_hours"] is not None:
+                entry["filled"] += 1
+                entry["fill_hours"].append(slot["time_to_fill_hours"])
+
+    slots = []
+    for entry in by_name.values():
+        fill_hours = entry.pop("fill_hours")
+        entry["fill_rate"] = _rate(entry["booked"], entry["limit"])
+        entry["median_time_to_fill_hours"] = round(float(np.median(fill_hours)), 2) if fill_hours else None
+        slots.append(entry)
+    slots.sort(key=lambda entry: entry["fill_rate"] or 0, reverse=True)
+
+    booked = sum(entry["booked"] for entry in slots)
+    capacity = sum(entry["limit"] for entry in slots)
+    submissions = sum(result["submissions"] for result in results)
+    return {
+        "classes": len(results),
+        "booked": booked,
+        "capacity": capacity,
+        "fill_rate": _rate(booked, capacity),
+        "cancellation_rate": _rate(sum(result["cancelled"] for result in results), submissions),
+        "duplicate_rate": _rate(sum(result["duplicates"] for result in results), submissions),
+        "slots": slots,
+    }
@@ -1,29 +1,48 @@
 import os
+import re
+import io
+import csv
 import sys
-import json
-import bcrypt
+import time
 import webbrowser
 import threading
-import time
+import multiprocessing
 
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, Response, g, render_template, request, redirect, url_for, session, flash, jsonify
 from google_auth_oauthlib.flow import Flow
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.errors import HttpError
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
 
+import submissions
+import credential_manager
+import admin_auth
+import jobs
+import booking_counts
+import bulk_import
+import booking_engine
+import analytics
+import export
+import sheet_mirror
+import notifications
+import metrics
+from notes_uploads import upload_pdf_to_drive
+from form_jobs import create_form_job, inject_script_job, delete_forms_job
+from google_clients import set_stats_label, client_stats, api_call_stats, is_transient
+
 from form_builder import (
-    create_form_and_link_sheet,
     get_linked_sheet_url,
     load_form_metadata,
-    inject_script_to_sheet,
+    get_form_metadata,
+    update_form_metadata,
     get_linked_sheet_id_from_form,
+    with_linked_sheet,
+    resolution_cache_stats,
     cancel_booking_by_phone,
+    cancel_bookings_across_forms,
     trigger_form_refresh,
     get_script_id_from_metadata,
-    update_sheet_url_in_metadata,
-    update_metadata_script_id
+    update_sheet_url_in_metadata
 )
 
 # Helper for PyInstaller compatibility
@@ -37,13 +56,7 @@ def get_resource_path(relative_path):
 # Writeable files must be in the working directory
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-UPLOAD_FOLDER = os.path.join(BASE_DIR, "uploads")
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
 CLIENT_SECRETS_FILE = get_resource_path("client_secret.json")
-FORMS_JSON_FILE = os.path.join(BASE_DIR, "forms.json")
-ADMIN_AUTH_FILE = os.path.join(BASE_DIR, "admin_auth.json")
-GOOGLE_CREDS_FILE = os.path.join(BASE_DIR, "google_creds.json")
 
 SCOPES = [
     "https://www.googleapis.com/auth/forms.body",
@@ -65,23 +78,75 @@ app = Flask(
     static_folder=get_resource_path('static')
 )
 app.secret_key = "your_super_secret_key"
+# Deployed behind one reverse proxy (the platform router) that sets
+# X-Forwarded-For, so remote_addr is the real client, e.g. for login
+# throttling. Set to the number of proxies in front, or 0 when serving
+# clients directly, where the header could be forged.
+TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", "1"))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+@app.before_request
+def label_google_clients():
+    set_stats_label(request.endpoint)
+    g.request_started = time.perf_counter()
+    # The outbox runs for as long as the app does, not per request
+    notifications.ensure_worker()
+
+def _route_labels():
+    # The URL rule, not the path, so form ids don't explode the label set
+    return (("route", request.url_rule.rule if request.url_rule else "unmatched"), ("method", request.method))
+
+@app.after_request
+def record_request_metrics(response):
+    labels = _route_labels()
+    metrics.observe("http_request_duration_seconds", labels, time.perf_counter() - g.request_started)
+    metrics.inc("http_requests_total", labels + (("status", str(response.status_code)),))
+    # Streamed responses have no length up front and are left out
+    if response.content_length is not None:
+        metrics.observe("http_response_size_bytes", labels, response.content_length)
+    return response
+
+@app.teardown_request
+def record_request_exception(exception):
+    if exception is not None:
+        metrics.inc("http_request_exceptions_total", _route_labels())
+
+@app.route("/metrics")
+def metrics_endpoint():
+    # Per process: with several gunicorn workers each scrape sees one of them
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 def ensure_google_credentials():
     if "credentials" not in session:
-        if os.path.exists(GOOGLE_CREDS_FILE):
-            with open(GOOGLE_CREDS_FILE, "r") as f:
-                session["credentials"] = json.load(f)
-            return True
-        return False
+        info = credential_manager.load_info()
+        if info is None:
+            return False
+        session["credentials"] = info
     return True
 
-def upload_pdf_to_drive(creds, filepath, filename):
-    drive_service = build("drive", "v3", credentials=creds)
-    file_metadata = {"name": filename, "mimeType": "application/pdf"}
-    media = MediaFileUpload(filepath, mimetype="application/pdf")
-    file = drive_service.files().create(body=file_metadata, media_body=media, fields="id").execute()
-    drive_service.permissions().create(fileId=file["id"], body={"type": "anyone", "role": "reader"}).execute()
-    return f"https://drive.google.com/uc?id={file['id']}&export=download"
+def current_credentials():
+    return credential_manager.get_credentials(session["credentials"])
+
+@app.errorhandler(HttpError)
+def google_unavailable(error):
+    # Reached only after execute() ran out of retries
+    if not is_transient(error):
+        raise error
+    if request.accept_mimetypes.best == "application/json" or request.endpoint == "dashboard":
+        return jsonify({"error": "Google is busy, please retry shortly."}), 503, {"Retry-After": "30"}
+    flash("Google is rate limiting requests right now. Please try again in a minute.", "warning")
+    return redirect(url_for("dashboard"))
+
+def job_response(job_id, message):
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({"job_id": job_id, "status_url": url_for("job_status", job_id=job_id)}), 202
+    flash(f"{message} Job {job_id[:8]} is running; see Recent Jobs below.", "info")
+    return redirect(url_for("dashboard"))
 
 @app.route("/")
 @app.route("/dashboard")
@@ -91,11 +156,24 @@ def dashboard():
     if not ensure_google_credentials():
         return redirect(url_for("login"))
     forms = load_form_metadata()
-    return render_template("dashboard.html", forms=forms)
+    creds = current_credentials()
+    counts = booking_counts.get_booking_counts(creds, forms)
+    return render_template("dashboard.html", forms=forms, counts=counts, jobs=jobs.recent_jobs())
+
+@app.route("/stats")
+def stats():
+    if "admin_logged_in" not in session:
+        return redirect(url_for("admin_login"))
+    return jsonify({
+        "google_clients": client_stats(),
+        "google_calls": api_call_stats(),
+        "sheet_resolution": resolution_cache_stats(),
+        "notification_outbox": notifications.outbox_stats()
+    })
 
 @app.route("/set_password", methods=["GET", "POST"])
 def set_password():
-    if os.path.exists(ADMIN_AUTH_FILE):
+    if admin_auth.has_password():
         return redirect(url_for("admin_login"))
     error = None
     if request.method == "POST":
@@ -106,22 +184,22 @@ def set_password():
         elif len(password) < 4:
             error = "Password too short."
         else:
-            hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
-            with open(ADMIN_AUTH_FILE, "w") as f:
-                json.dump({"password": hashed}, f)
+            admin_auth.set_password(password)
             return redirect(url_for("admin_login"))
     return render_template("set_password.html", error=error)
 
 @app.route("/admin_login", methods=["GET", "POST"])
 def admin_login():
-    if not os.path.exists(ADMIN_AUTH_FILE):
+    if not admin_auth.has_password():
         return redirect(url_for("set_password"))
     error = None
     if request.method == "POST":
         password = request.form["password"]
-        with open(ADMIN_AUTH_FILE, "r") as f:
-            data = json.load(f)
-        if bcrypt.checkpw(password.encode(), data["password"].encode()):
+        wait = admin_auth.retry_after(request.remote_addr)
+        if wait:
+            error = f"Too many attempts. Try again in {int(wait) + 1} seconds."
+            return render_template("admin_login.html", error=error), 429
+        if admin_auth.verify_password(password, request.remote_addr):
             session["admin_logged_in"] = True
             return redirect(url_for("dashboard"))
         error = "Incorrect password."
@@ -130,8 +208,7 @@ def admin_login():
 @app.route("/logout")
 def logout():
     session.clear()
-    if os.path.exists(GOOGLE_CREDS_FILE):
-        os.remove(GOOGLE_CREDS_FILE)
+    credential_manager.forget()
     return redirect(url_for("admin_login"))
 
 @app.route("/login")
@@ -156,25 +233,14 @@ def oauth2callback():
         redirect_uri=url_for("oauth2callback", _external=True)
     )
     flow.fetch_token(authorization_response=request.url)
-    creds = flow.credentials
-    creds_data = {
-        "token": creds.token,
-        "refresh_token": creds.refresh_token,
-        "token_uri": creds.token_uri,
-        "client_id": creds.client_id,
-        "client_secret": creds.client_secret,
-        "scopes": creds.scopes
-    }
-    session["credentials"] = creds_data
-    with open(GOOGLE_CREDS_FILE, "w") as f:
-        json.dump(creds_data, f)
+    session["credentials"] = credential_manager.save(flow.credentials)
     return redirect(url_for("dashboard"))
 
 @app.route("/create_form", methods=["POST"])
 def create_form():
     if "admin_logged_in" not in session:
         return redirect(url_for("admin_login"))
-    creds = Credentials.from_authorized_user_info(info=session["credentials"])
+    creds = current_credentials()
     class_name = request.form["class_name"]
 
     slot_names = request.form.getlist("slot_name[]")
@@ -189,11 +255,7 @@ def create_form():
     notes_url = ""
     pdf = request.files.get("notes_pdf")
     if pdf and pdf.filename:
-        filename = secure_filename(pdf.filename)
-        path = os.path.join(UPLOAD_FOLDER, filename)
-        pdf.save(path)
-        notes_url = upload_pdf_to_drive(creds, path, filename)
-        os.remove(path)
+        notes_url = upload_pdf_to_drive(creds, pdf.stream, secure_filename(pdf.filename))
 
     form_info = {
         "title": class_name,
@@ -204,53 +266,57 @@ def create_form():
         "notes": notes_url.strip()
     }
 
-    form_url, edit_url, form_id = create_form_and_link_sheet(creds, form_info)
-    time.sleep(5)
-    update_sheet_url_in_metadata(creds, form_id)
+    job_id = jobs.submit("create_form", create_form_job, creds, form_info)
+    return job_response(job_id, "Form creation started.")
 
-    flash("Form created successfully.", "success")
-    return redirect(url_for("dashboard"))
+@app.route("/bulk_create", methods=["POST"])
+def bulk_create():
+    if "admin_logged_in" not in session:
+        return redirect(url_for("admin_login"))
+    if not ensure_google_credentials():
+        return redirect(url_for("login"))
+    creds = current_credentials()
+    schedule = request.files.get("schedule")
+    if not schedule or not schedule.filename:
+        flash("Upload a CSV or JSON schedule.", "danger")
+        return redirect(url_for("dashboard"))
+    try:
+        classes = bulk_import.parse_schedule(schedule.filename, schedule.read())
+    except ValueError as e:
+        flash(f"Schedule not imported: {e}", "danger")
+        return redirect(url_for("dashboard"))
+    if not classes:
+        flash("The schedule has no classes.", "danger")
+        return redirect(url_for("dashboard"))
+
+    job_id = jobs.submit("bulk_create", bulk_import.bulk_create_job, creds, classes)
+    return job_response(job_id, f"Creating {len(classes)} class(es).")
 
 @app.route("/inject_script/<form_id>", methods=["POST"])
 def inject_script(form_id):
     if "admin_logged_in" not in session:
         return redirect(url_for("admin_login"))
-    creds = Credentials.from_authorized_user_info(info=session["credentials"])
-    sheet_id = get_linked_sheet_id_from_form(creds, form_id)
-    forms = load_form_metadata()
-    target = next((f for f in forms if f["form_id"] == form_id), None)
-    if not target:
+    creds = current_credentials()
+    if not get_form_metadata(form_id):
         flash("Form not found.", "danger")
         return redirect(url_for("dashboard"))
-    slot_limits = {s["name"]: {"limit": s["limit"], "expiry": s["date"]} for s in target["slots"]}
-    script_id = inject_script_to_sheet(
-        creds,
-        sheet_id,
-        target["class_name"],
-        target["form_edit_url"],
-        slot_limits,
-        form_id,
-        target.get("meet_link", ""),
-        target.get("notes", "")
-    )
-    update_metadata_script_id(form_id, script_id)
-    flash("Script injected successfully.", "success")
-    return redirect(url_for("dashboard"))
+    job_id = jobs.submit("inject_script", inject_script_job, creds, form_id, form_id=form_id)
+    return job_response(job_id, "Script injection started.")
 
 @app.route("/edit_metadata/<form_id>", methods=["GET", "POST"])
 def edit_metadata(form_id):
     if "admin_logged_in" not in session:
         return redirect(url_for("admin_login"))
-    forms = load_form_metadata()
-    target = next((f for f in forms if f["form_id"] == form_id), None)
+    target = get_form_metadata(form_id)
     if not target:
         flash("Form not found.", "danger")
         return redirect(url_for("dashboard"))
     if request.method == "POST":
-        target["meet_link"] = request.form.get("meet_link", "").strip()
-        target["notes"] = request.form.get("notes", "").strip()
-        with open(FORMS_JSON_FILE, "w") as f:
-            json.dump(forms, f, indent=2)
+        update_form_metadata(
+            form_id,
+            meet_link=request.form.get("meet_link", "").strip(),
+            notes=request.form.get("notes", "").strip()
+        )
         flash("Metadata updated. Re-inject script to apply changes.", "success")
         return redirect(url_for("dashboard"))
     return render_template("edit_metadata.html", form=target)
@@ -265,19 +331,17 @@ def change_password():
         current = request.form["current_password"]
         new = request.form["new_password"]
         confirm = request.form["confirm_password"]
-        with open(ADMIN_AUTH_FILE, "r") as f:
-            data = json.load(f)
-        stored_hash = data.get("password", "")
-        if not bcrypt.checkpw(current.encode(), stored_hash.encode()):
+        wait = admin_auth.retry_after(request.remote_addr)
+        if wait:
+            error = f"Too many attempts. Try again in {int(wait) + 1} seconds."
+        elif not admin_auth.verify_password(current, request.remote_addr):
             error = "Current password is incorrect."
         elif new != confirm:
             error = "New passwords do not match."
         elif len(new) < 4:
             error = "New password must be at least 4 characters."
         else:
-            new_hash = bcrypt.hashpw(new.encode(), bcrypt.gensalt()).decode()
-            with open(ADMIN_AUTH_FILE, "w") as f:
-                json.dump({"password": new_hash}, f)
+            admin_auth.set_password(new)
             success = "Password changed successfully."
     return render_template("change_password.html", error=error, success=success)
 
@@ -286,43 +350,20 @@ def change_password():
 def view_submissions(form_id):
     if "admin_logged_in" not in session:
         return redirect(url_for("admin_login"))
-    creds = Credentials.from_authorized_user_info(info=session["credentials"])
+    creds = current_credentials()
 
-    forms = load_form_metadata()
-    target = next((f for f in forms if f["form_id"] == form_id), None)
+    target = get_form_metadata(form_id)
     if not target:
         flash("Form not found.", "danger")
         return redirect(url_for("dashboard"))
 
-    if target.get("sheet_url"):
-        sheet_id = target["sheet_url"].split("/d/")[1].split("/")[0]
-    else:
-        sheet_id = get_linked_sheet_id_from_form(creds, form_id)
-
-    sheets_service = build("sheets", "v4", credentials=creds)
-    result = sheets_service.spreadsheets().values().get(
-        spreadsheetId=sheet_id,
-        range="A1:Z1000"
-    ).execute()
-    values = result.get("values", [])
+    table = with_linked_sheet(creds, form_id, lambda sheet_id: submissions.load_table(creds, sheet_id))
 
-    if not values or len(values) < 2:
-        return render_template("view_submissions.html", form=target, submissions=[], chart_data={})
+    if not table["rows"]:
+        return render_template("view_submissions.html", form=target, table=None, result=None, filters={}, chart_data={})
 
-    headers = values[0]
-    submissions = [dict(zip(headers, row)) for row in values[1:]]
-
-    slot_counts = {}
     form_slots = {s["name"]: s["limit"] for s in target["slots"]}
-    for slot in form_slots:
-        slot_counts[slot] = 0
-
-    for submission in submissions:
-        raw_slot = submission.get("Choose a Slot", "").strip()
-        slot_clean = raw_slot.split(" (")[0].strip()
-        status = submission.get("Status", "").strip().lower()
-        if status != "cancelled" and slot_clean in slot_counts:
-            slot_counts[slot_clean] += 1
+    slot_counts = submissions.slot_counts(table, form_slots)
 
     chart_data = {
         "slots": list(slot_counts.keys()),
@@ -330,37 +371,153 @@ def view_submissions(form_id):
         "limits": [form_slots[s] for s in slot_counts]
     }
 
+    filters = {
+        "slot": request.args.get("slot", "").strip(),
+        "status": request.args.get("status", "").strip().lower(),
+        "sort": request.args.get("sort", ""),
+        "order": "desc" if request.args.get("order") == "desc" else "asc",
+        "size": request.args.get("size", submissions.DEFAULT_PAGE_SIZE, type=int)
+    }
+    result = submissions.query(
+        table,
+        slot=filters["slot"],
+        status=filters["status"],
+        sort=filters["sort"],
+        descending=filters["order"] == "desc",
+        page=request.args.get("page", 1, type=int),
+        size=filters["size"]
+    )
+
     return render_template(
         "view_submissions.html",
         form=target,
-        submissions=submissions,
+        table=table,
+        result=result,
+        filters=filters,
         chart_data=chart_data
     )
 
 
+def linked_sheet_states(creds, forms):
+    # (form, sheet_id, mirror state) for every form with a responses sheet
+    sources = []
+    for form in forms:
+        try:
+            sheet_id, state = with_linked_sheet(
+                creds, form["form_id"], lambda sheet_id: (sheet_id, sheet_mirror.ensure_fresh(creds, sheet_id))
+            )
+        except ValueError:
+            # No responses sheet linked yet
+            continue
+        sources.append((form, sheet_id, state))
+    return sources
+
+
+def export_response(rows, name, fmt):
+    # Rows are pulled from the mirror as the client reads, so memory stays
+    # flat however large the class is.
+    return Response(
+        export.stream(rows, fmt),
+        mimetype=export.FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{secure_filename(name) or "submissions"}.{fmt}"'}
+    )
+
+
+@app.route("/export/<form_id>")
+def export_submissions(form_id):
+    if "admin_logged_in" not in session:
+        return redirect(url_for("admin_login"))
+    if not ensure_google_credentials():
+        return redirect(url_for("login"))
+    fmt = request.args.get("format", "csv")
+    if fmt not in export.FORMATS:
+        return jsonify({"error": "Format must be csv or xlsx."}), 400
+    target = get_form_metadata(form_id)
+    if not target:
+        flash("Form not found.", "danger")
+        return redirect(url_for("dashboard"))
+    creds = current_credentials()
+
+    sheet_id, state = with_linked_sheet(
+        creds, form_id, lambda sheet_id: (sheet_id, sheet_mirror.ensure_fresh(creds, sheet_id))
+    )
+    rows = export.form_rows(
+        sheet_id, state,
+        slot=request.args.get("slot", "").strip(),
+        status=request.args.get("status", "").strip().lower()
+    )
+    return export_response(rows, target["class_name"], fmt)
+
+
+@app.route("/export_all")
+def export_all_submissions():
+    if "admin_logged_in" not in session:
+        return redirect(url_for("admin_login"))
+    if not ensure_google_credentials():
+        return redirect(url_for("login"))
+    fmt = request.args.get("format", "csv")
+    if fmt not in export.FORMATS:
+        return jsonify({"error": "Format must be csv or xlsx."}), 400
+    creds = current_credentials()
+
+    # Mirrors are brought up to date before the first byte goes out, so a
+    # Google error becomes a normal error page rather than a cut-off file
+    rows = export.all_forms_rows(
+        linked_sheet_states(creds, load_form_metadata()),
+        slot=request.args.get("slot", "").strip(),
+        status=request.args.get("status", "").strip().lower()
+    )
+    return export_response(rows, "all_submissions", fmt)
+
+
+def collect_analytics(form_id=None):
+    creds = current_credentials()
+    forms = load_form_metadata()
+    if form_id:
+        forms = [form for form in forms if form["form_id"] == form_id]
+    results = [analytics.form_analytics(*source) for source in linked_sheet_states(creds, forms)]
+    return {"summary": analytics.summarize(results), "classes": results}
+
+
+@app.route("/analytics")
+def analytics_page():
+    if "admin_logged_in" not in session:
+        return redirect(url_for("admin_login"))
+    if not ensure_google_credentials():
+        return redirect(url_for("login"))
+    return render_template("analytics.html", data=collect_analytics(request.args.get("form_id")))
+
+
+@app.route("/analytics.json")
+def analytics_json():
+    if "admin_logged_in" not in session:
+        return jsonify({"error": "Not logged in."}), 401
+    if not ensure_google_credentials():
+        return jsonify({"error": "Google account not connected."}), 401
+    return jsonify(collect_analytics(request.args.get("form_id")))
+
+
 @app.route("/update_sheet_url/<form_id>")
 def update_sheet_url(form_id):
     if "admin_logged_in" not in session:
         return redirect(url_for("admin_login"))
     if not ensure_google_credentials():
         return redirect(url_for("login"))
-    creds = Credentials.from_authorized_user_info(info=session["credentials"])
+    creds = current_credentials()
 
-    forms = load_form_metadata()
-    target = next((f for f in forms if f["form_id"] == form_id), None)
+    target = get_form_metadata(form_id)
     if not target:
         flash("Form not found.", "danger")
         return redirect(url_for("dashboard"))
 
-    sheet_id = get_linked_sheet_id_from_form(creds, form_id)
+    # Explicit user action: bypass the resolution cache
+    sheet_id = get_linked_sheet_id_from_form(creds, form_id, refresh=True)
     if not sheet_id:
         flash("Could not find linked Google Sheet. Make sure you linked the form to a Sheet in Google Forms > Responses.", "danger")
         return redirect(url_for("dashboard"))
 
     sheet_url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/edit"
-    target["sheet_url"] = sheet_url
-    with open(FORMS_JSON_FILE, "w") as f:
-        json.dump(forms, f, indent=2)
+    update_sheet_url_in_metadata(form_id, sheet_url)
 
     flash("Sheet URL updated successfully.", "success")
     return redirect(url_for("dashboard"))
@@ -370,12 +527,13 @@ def update_sheet_url(form_id):
 def refresh_slots(form_id):
     if "admin_logged_in" not in session:
         return redirect(url_for("admin_login"))
-    creds = Credentials.from_authorized_user_info(info=session["credentials"])
+    creds = current_credentials()
     script_id = get_script_id_from_metadata(form_id)
     if not script_id:
         flash("Script ID not found.", "danger")
         return redirect(url_for("dashboard"))
     trigger_form_refresh(creds, script_id)
+    booking_counts.invalidate(form_id)
     flash("Slots refreshed successfully.", "success")
     return redirect(url_for("dashboard"))
 
@@ -384,106 +542,164 @@ def refresh_slots(form_id):
 def cancel_booking():
     if "admin_logged_in" not in session:
         return redirect(url_for("admin_login"))
-    creds = Credentials.from_authorized_user_info(info=session["credentials"])
+    creds = current_credentials()
     form_id = request.form["form_id"]
     mobile = request.form["mobile_number"].strip()
     result = cancel_booking_by_phone(creds, form_id, mobile)
+    booking_counts.invalidate(form_id)
     flash(result, "info")
     return redirect(url_for("dashboard"))
 
 
+def parse_mobile_numbers(text, csv_file=None):
+    numbers = re.split(r"[\s,;]+", text or "")
+    if csv_file and csv_file.filename:
+        reader = csv.reader(io.TextIOWrapper(csv_file.stream, encoding="utf-8-sig"))
+        numbers += [row[0] for row in reader if row and any(c.isdigit() for c in row[0])]
+    # Keep input order, drop blanks and repeats
+    return list(dict.fromkeys(n.strip() for n in numbers if n.strip()))
+
+
+@app.route("/cancel_bookings", methods=["POST"])
+def cancel_bookings_bulk():
+    if "admin_logged_in" not in session:
+        return redirect(url_for("admin_login"))
+    creds = current_credentials()
+    form_ids = request.form.getlist("form_id")
+    mobiles = parse_mobile_numbers(request.form.get("mobile_numbers", ""), request.files.get("mobile_csv"))
+    if not form_ids or not mobiles:
+        flash("Select at least one form and enter mobile numbers to cancel.", "danger")
+        return redirect(url_for("dashboard"))
+
+    report = cancel_bookings_across_forms(creds, form_ids, mobiles)
+    for form_id in form_ids:
+        booking_counts.invalidate(form_id)
+    if request.args.get("format") == "json":
+        return jsonify(report)
+    return render_template("cancel_report.html", report=report)
+
+
 @app.route("/delete_form/<form_id>")
 def delete_form(form_id):
     if "admin_logged_in" not in session:
         return redirect(url_for("admin_login"))
     if not ensure_google_credentials():
         return redirect(url_for("login"))
-    creds = Credentials.from_authorized_user_info(info=session["credentials"])
-
-    drive_service = build("drive", "v3", credentials=creds)
-    forms_service = build("forms", "v1", credentials=creds)
-
-    try:
-        drive_service.files().delete(fileId=form_id).execute()
-        flash("Form file deleted from Drive.", "success")
-    except Exception as e:
-        flash(f"Error deleting Form file: {e}", "danger")
+    creds = current_credentials()
 
-    try:
-        form = forms_service.forms().get(formId=form_id).execute()
-        sheet_id = form.get("linkedSheetId")
-        if sheet_id:
-            drive_service.files().delete(fileId=sheet_id).execute()
-            flash("Linked Sheet deleted from Drive.", "success")
-        else:
-            flash("No linked Sheet found.", "info")
-    except Exception as e:
-        flash(f"Error deleting linked Sheet: {e}", "danger")
+    job_id = jobs.submit("delete_form", delete_forms_job, creds, [form_id], form_id=form_id)
+    return job_response(job_id, "Form deletion started.")
 
-    forms = load_form_metadata()
-    forms = [f for f in forms if f["form_id"] != form_id]
-    with open(FORMS_JSON_FILE, "w") as f:
-        json.dump(forms, f, indent=2)
 
-    flash("Metadata removed.", "success")
-    return redirect(url_for("dashboard"))
+@app.route("/delete_forms", methods=["POST"])
+def delete_forms_bulk():
+    if "admin_logged_in" not in session:
+        return redirect(url_for("admin_login"))
+    if not ensure_google_credentials():
+        return redirect(url_for("login"))
+    creds = current_credentials()
+    form_ids = request.form.getlist("form_id")
+    if not form_ids:
+        flash("Select at least one form to delete.", "danger")
+        return redirect(url_for("dashboard"))
+    job_id = jobs.submit("delete_forms", delete_forms_job, creds, form_ids)
+    return job_response(job_id, f"Deleting {len(form_ids)} form(s).")
 
 
 @app.route("/update_metadata/<form_id>", methods=["POST"])
 def update_metadata(form_id):
     if "admin_logged_in" not in session:
         return redirect(url_for("admin_login"))
-    creds = Credentials.from_authorized_user_info(info=session["credentials"])
+    creds = current_credentials()
 
-    forms = load_form_metadata()
-    target = next((f for f in forms if f["form_id"] == form_id), None)
+    target = get_form_metadata(form_id)
     if not target:
         flash("Form not found.", "danger")
         return redirect(url_for("dashboard"))
 
+    changes = {}
     meet_link = request.form.get("meet_link", "").strip()
     if meet_link:
-        target["meet_link"] = meet_link
+        changes["meet_link"] = meet_link
 
     pdf_file = request.files.get("notes_pdf")
     if pdf_file and pdf_file.filename:
-        filename = secure_filename(pdf_file.filename)
-        path = os.path.join(UPLOAD_FOLDER, filename)
-        pdf_file.save(path)
-        notes_url = upload_pdf_to_drive(creds, path, filename)
-        target["notes"] = notes_url
-        os.remove(path)
-
-    with open(FORMS_JSON_FILE, "w") as f:
-        json.dump(forms, f, indent=2)
+        changes["notes"] = upload_pdf_to_drive(creds, pdf_file.stream, secure_filename(pdf_file.filename))
+
+    if changes:
+        update_form_metadata(form_id, **changes)
+
+    job_id = jobs.submit("update_metadata", inject_script_job, creds, form_id, form_id=form_id)
+    return job_response(job_id, "Metadata updated. Script re-injection started.")
+
+
+def booking_credentials():
+    # The public booking page has no session; it uses the admin's stored
+    # Google account to read what the sheet already holds.
+    info = credential_manager.load_info()
+    if info is None:
+        raise booking_engine.BookingRejected("Booking is not open yet.", "unavailable")
+    return credential_manager.get_credentials(info)
+
+
+@app.route("/book/<form_id>", methods=["GET", "POST"])
+def book(form_id):
+    # Public booking page: no admin login, capacity enforced locally
+    form = get_form_metadata(form_id)
+    if not form:
+        return render_template("book.html", form=None, slots={}, error="Class not found."), 404
+    wants_json = request.is_json or request.accept_mimetypes.best == "application/json"
+
+    if request.method == "GET":
+        try:
+            if not booking_engine.capacity_current(form):
+                booking_engine.sync_capacity(booking_credentials(), form)
+        except booking_engine.BookingRejected as e:
+            return render_template("book.html", form=form, slots={}, error=str(e)), 503
+        return render_template("book.html", form=form, slots=booking_engine.availability(form_id), error=None)
+
+    data = request.get_json(silent=True) or request.form
+    fields = {key: str(data.get(key, "")).strip() for key in ("slot", "name", "email", "phone")}
+    if not fields["slot"] or not fields["name"] or not fields["phone"]:
+        error, status = "Slot, name and mobile number are required.", 400
+    else:
+        try:
+            try:
+                booking_id = booking_engine.reserve(form_id, **fields)
+            except booking_engine.BookingRejected as e:
+                if e.reason != "unknown_slot":
+                    raise
+                # Slots added since the capacity table was last synced
+                booking_engine.sync_capacity(booking_credentials(), form)
+                booking_id = booking_engine.reserve(form_id, **fields)
+        except booking_engine.BookingRejected as e:
+            error, status = str(e), {"unknown_slot": 404, "unavailable": 503}.get(e.reason, 409)
+        else:
+            if wants_json:
+                return jsonify({"booking_id": booking_id, "slot": fields["slot"]}), 201
+            return render_template("book.html", form=form, slots=booking_engine.availability(form_id),
+                                   error=None, booked=fields["slot"]), 201
 
-    sheet_id = get_linked_sheet_id_from_form(creds, form_id)
-    if not sheet_id:
-        flash("Linked sheet not found.", "danger")
-        return redirect(url_for("dashboard"))
+    if wants_json:
+        return jsonify({"error": error}), status
+    return render_template("book.html", form=form, slots=booking_engine.availability(form_id), error=error), status
 
-    slot_limits = {s["name"]: {"limit": s["limit"], "expiry": s["date"]} for s in target["slots"]}
-    script_id = inject_script_to_sheet(
-        creds,
-        sheet_id,
-        target["class_name"],
-        target["form_edit_url"],
-        slot_limits,
-        form_id,
-        target.get("meet_link", ""),
-        target.get("notes", "")
-    )
-    target["script_id"] = script_id
-    with open(FORMS_JSON_FILE, "w") as f:
-        json.dump(forms, f, indent=2)
 
-    flash("Metadata updated and script re-injected.", "success")
-    return redirect(url_for("dashboard"))
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    if "admin_logged_in" not in session:
+        return jsonify({"error": "Not logged in."}), 401
+    job = jobs.get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found."}), 404
+    return jsonify(job)
 
 # Automatically open browser after server starts
 def open_browser():
     webbrowser.open("http://localhost:5000")
 
 if __name__ == "__main__":
+    # Needed for the bcrypt process pool in the frozen (PyInstaller) build
+    multiprocessing.freeze_support()
     threading.Timer(1.5, open_browser).start()
     app.run(debug=False)
@@ -0,0 +1,207 @@
+"""Benchmark the admin routes against the in-memory fake Google backend.
+
+Drives dashboard, view_submissions, cancel_booking, create_form and
+update_metadata through the Flask test client and reports p50/p99 latency,
+Google API calls per request and peak traced memory per route. Before
+that, /book is checked to refuse students already booked through the form.
+
+    python benchmark.py [iterations] [rows_per_sheet] [forms] [latency_ms]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+# Everything the app persists goes to a scratch directory, and the token
+# buckets are opened up so the numbers measure the app, not the throttle.
+_workdir = tempfile.mkdtemp(prefix="booking-bench-")
+os.environ.setdefault("BOOKING_DB", os.path.join(_workdir, "booking.db"))
+os.environ.setdefault("GOOGLE_CREDS_FILE", os.path.join(_workdir, "google_creds.json"))
+os.environ.setdefault("ADMIN_AUTH_FILE", os.path.join(_workdir, "admin_auth.json"))
+os.environ.setdefault("NOTIFY_GATEWAY", "stub")
+for _api in ("SHEETS", "FORMS", "DRIVE", "SCRIPT"):
+    os.environ.setdefault(f"GOOGLE_RATE_{_api}", "1000000,1000000")
+
+import credential_manager
+import google_clients
+import jobs
+import metadata_store
+from app import app
+from fake_google import FakeGoogle, RESPONSE_HEADERS
+from form_builder import form_metadata_entry, sheet_url_for
+
+
+# Don't pull the real forms.json into the scratch database
+metadata_store.LEGACY_JSON_FILE = os.path.join(_workdir, "forms.json")
+
+SLOTS = ["Monday 10am", "Monday 4pm", "Tuesday 10am", "Wednesday 6pm"]
+JOB_TIMEOUT = 60
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def seed(fake, forms, rows):
+    slot_date = (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%dT%H:%M")
+    seeded = []
+    for n in range(forms):
+        bookings = fake.seed_bookings(rows, SLOTS, seed=n)
+        sheet_id = fake.add_sheet(bookings, headers=RESPONSE_HEADERS + ["Status"])
+        form_id, _ = fake.add_form(f"Class {n}", sheet_id=sheet_id)
+        form_info = {
+            "class_name": f"Class {n}",
+            "slots": [{"name": s, "limit": rows, "date": slot_date} for s in SLOTS],
+            "meet_link": "https://meet.example.com/abc",
+            "notes": ""
+        }
+        entry = form_metadata_entry(
+            form_info, form_id,
+            f"https://docs.google.com/forms/d/{form_id}/viewform",
+            f"https://docs.google.com/forms/d/{form_id}/edit"
+        )
+        entry["sheet_url"] = sheet_url_for(sheet_id)
+        metadata_store.add_form(entry)
+        seeded.append((form_id, bookings))
+    return seeded, slot_date
+
+
+def bench_credentials():
+    return {
+        "token": "fake-token",
+        "refresh_token": "fake-refresh",
+        "token_uri": "https://oauth2.googleapis.com/token",
+        "client_id": "bench",
+        "client_secret": "bench",
+        "scopes": [],
+        "expiry": (datetime.utcnow() + timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    }
+
+
+def login(client):
+    with client.session_transaction() as session:
+        session["admin_logged_in"] = True
+        session["credentials"] = bench_credentials()
+
+
+def finish_job(response):
+    # Job routes answer 202 with the job id; the benchmark waits for the job
+    # so its Google calls and time are charged to the route that started it.
+    if response.status_code != 202:
+        return response.status_code
+    job = jobs.wait(response.get_json()["job_id"], timeout=JOB_TIMEOUT, interval=0.005)
+    if not job or job["status"] != "done":
+        raise RuntimeError(f"Job did not finish: {job}")
+    return response.status_code
+
+
+def check_booking_duplicates(client, seeded):
+    # /book must refuse a phone or email that only exists in the sheet, i.e.
+    # a Google Form booking, not just ones it took itself. Returns failures.
+    with open(credential_manager.CREDS_FILE, "w") as f:
+        json.dump(bench_credentials(), f)
+    form_id, bookings = seeded[0]
+    active = next(row for row in bookings if len(row) < 5)
+    cases = [
+        ("phone in sheet", {"phone": active[2], "email": "new-student@example.com"}, 409),
+        ("email in sheet", {"phone": "8000000001", "email": active[1].upper()}, 409),
+        ("new student", {"phone": "8000000002", "email": "other-student@example.com"}, 201),
+        ("same student again", {"phone": "8000000002", "email": "other-student@example.com"}, 409),
+    ]
+    failures = 0
+    for label, fields, expected in cases:
+        body = dict(fields, slot=SLOTS[0], name="Bench Student")
+        status = client.post(f"/book/{form_id}", json=body).status_code
+        if status != expected:
+            print(f"booking check '{label}': got {status}, expected {expected}")
+            failures += 1
+    print(f"booking duplicate checks: {len(cases) - failures}/{len(cases)} ok")
+    return failures
+
+
+def scenarios(seeded, slot_date):
+    form_ids = [form_id for form_id, _ in seeded]
+    json_headers = {"Accept": "application/json"}
+
+    def dashboard(client, i):
+        return client.get("/dashboard").status_code
+
+    def view_submissions(client, i):
+        form_id = form_ids[i % len(form_ids)]
+        return client.get(f"/view_submissions/{form_id}?page={i % 5 + 1}&status=active").status_code
+
+    def cancel_booking(client, i):
+        form_id, bookings = seeded[i % len(seeded)]
+        mobile = bookings[(i * 7919) % len(bookings)][2] if bookings else "0000000000"
+        return client.post("/cancel_booking", data={"form_id": form_id, "mobile_number": mobile}).status_code
+
+    def create_form(client, i):
+        data = {
+            "class_name": f"Bench class {i}",
+            "slot_name[]": SLOTS[:2],
+            "slot_limit[]": ["20", "20"],
+            "slot_date[]": [slot_date, slot_date],
+            "meet_link": "https://meet.example.com/new"
+        }
+        return finish_job(client.post("/create_form", data=data, headers=json_headers))
+
+    def update_metadata(client, i):
+        form_id = form_ids[i % len(form_ids)]
+        data = {"meet_link": f"https://meet.example.com/{i}"}
+        return finish_job(client.post(f"/update_metadata/{form_id}", data=data, headers=json_headers))
+
+    return [dashboard, view_submissions, cancel_booking, create_form, update_metadata]
+
+
+def run(iterations=20, rows=1000, forms=3, latency_ms=0.0):
+    fake = FakeGoogle(latency=latency_ms / 1000.0)
+    google_clients.set_service_factory(fake.service)
+    seeded, slot_date = seed(fake, forms, rows)
+    client = app.test_client()
+    login(client)
+
+    print(f"{iterations} iterations, {forms} forms x {rows} rows, {latency_ms:g} ms fake latency")
+    print(f"{'route':<18}{'p50 ms':>10}{'p99 ms':>10}{'calls/req':>11}{'peak KiB':>10}  top calls")
+    failures = check_booking_duplicates(client, seeded)
+    for scenario in scenarios(seeded, slot_date):
+        timings = []
+        calls_before = fake.calls.copy()
+        tracemalloc.start()
+        for i in range(iterations):
+            started = time.perf_counter()
+            status = scenario(client, i)
+            timings.append(time.perf_counter() - started)
+            if status >= 400:
+                failures += 1
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        calls = fake.calls - calls_before
+        top = ", ".join(f"{name.split('.', 1)[1]}={count}" for name, count in calls.most_common(3))
+        print(
+            f"{scenario.__name__:<18}"
+            f"{percentile(timings, 0.5) * 1000:>10.1f}"
+            f"{percentile(timings, 0.99) * 1000:>10.1f}"
+            f"{sum(calls.values()) / iterations:>11.2f}"
+            f"{peak / 1024:>10.0f}  {top}"
+        )
+    if failures:
+        print(f"{failures} request(s) failed")
+    return 1 if failures else 0
+
+
+def main(argv):
+    iterations = int(argv[1]) if len(argv) > 1 else 20
+    rows = int(argv[2]) if len(argv) > 2 else 1000
+    forms = int(argv[3]) if len(argv) > 3 else 3
+    latency_ms = float(argv[4]) if len(argv) > 4 else 0.0
+    return run(iterations, rows, forms, latency_ms)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import metadata_store
+import sheet_mirror
+from form_builder import sheet_id_from_url
+from google_clients import get_service, execute
+from submissions import SLOT_HEADER, STATUS_HEADER, normalize_slot, normalize_status
+
+
+BOOKING_COUNTS_TTL_SECONDS = float(os.environ.get("BOOKING_COUNTS_TTL_SECONDS", "120"))
+# Shared by every dashboard request in the process, so concurrent page loads
+# cannot multiply Sheets read traffic beyond this many calls in flight.
+DASHBOARD_FETCH_WORKERS = int(os.environ.get("DASHBOARD_FETCH_WORKERS", "4"))
+# The dashboard renders after this long even if some sheets haven't answered
+DASHBOARD_COUNTS_WAIT_SECONDS = float(os.environ.get("DASHBOARD_COUNTS_WAIT_SECONDS", "5"))
+
+metadata_store.register_schema("""
+CREATE TABLE IF NOT EXISTS booking_counts (
+    form_id TEXT PRIMARY KEY,
+    counts TEXT NOT NULL,
+    layout TEXT,
+    fetched_at REAL NOT NULL
+);
+""")
+
+_executor = None
+_executor_lock = threading.Lock()
+# form_id -> the refresh already running for it, shared by concurrent loads
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DASHBOARD_FETCH_WORKERS, thread_name_prefix="counts")
+        return _executor
+
+
+def _layout(headers):
+    slot_col = headers.index(SLOT_HEADER) if SLOT_HEADER in headers else -1
+    status_col = headers.index(STATUS_HEADER) if STATUS_HEADER in headers else -1
+    return [slot_col, status_col]
+
+
+def _read_columns(sheets_service, sheet_id, ranges):
+    result = execute(sheets_service.spreadsheets().values().batchGet(
+        spreadsheetId=sheet_id,
+        ranges=ranges,
+        majorDimension="COLUMNS"
+    ))
+    return [value_range.get("values") or [] for value_range in result.get("valueRanges", [])]
+
+
+def _fetch_columns(sheets_service, sheet_id, layout):
+    # One read: the header row rides along with the slot and status columns
+    # so moved or new columns are noticed. Only a changed layout costs a
+    # second read. Ranges without a tab name address the responses tab.
+    wanted = [col for col in layout if col != -1]
+    value_ranges = _read_columns(
+        sheets_service, sheet_id, ["1:1"] + [f"{sheet_mirror.column_letter(col)}:{sheet_mirror.column_letter(col)}" for col in wanted]
+    )
+    headers = [column[0] if column else "" for column in value_ranges[0]]
+    current = _layout(headers)
+    if current != layout:
+        return _fetch_sheet(sheets_service, sheet_id)
+    by_col = {col: (values[0] if values else []) for col, values in zip(wanted, value_ranges[1:])}
+    return layout, [by_col.get(col, []) for col in layout]
+
+
+def _fetch_sheet(sheets_service, sheet_id):
+    # Columns unknown: the whole sheet in one read, then pick them out
+    columns = _read_columns(sheets_service, sheet_id, ["A:ZZ"])[0]
+    layout = _layout([column[0] if column else "" for column in columns])
+    return layout, [columns[col] if 0 <= col < len(columns) else [] for col in layout]
+
+
+def _fetch_counts(creds, form, layout):
+    sheets_service = get_service(creds, "sheets", "v4")
+    sheet_id = sheet_id_from_url(form["sheet_url"])
+    if layout is None:
+        # First fetch for this form: the mirror usually knows the columns
+        state = sheet_mirror.get_state(sheet_id)
+        layout = _layout(state["headers"]) if state else None
+    if layout is None:
+        layout, (slots, statuses) = _fetch_sheet(sheets_service, sheet_id)
+    else:
+        layout, (slots, statuses) = _fetch_columns(sheets_service, sheet_id, layout)
+    if layout[0] == -1:
+        return {}, layout
+
+    counts = {s["name"]: 0 for s in form["slots"]}
+    slots, statuses = slots[1:], statuses[1:]
+    for i, raw_slot in enumerate(slots):
+        slot = normalize_slot(raw_slot)
+        status = normalize_status(statuses[i]) if i < len(statuses) else ""
+        if status != "cancelled" and slot in counts:
+            counts[slot] += 1
+    return counts, layout
+
+
+def _store(form_id, counts, layout):
+    with metadata_store.transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO booking_counts (form_id, counts, layout, fetched_at) VALUES (?, ?, ?, ?)",
+            (form_id, json.dumps(counts), json.dumps(layout), time.time())
+        )
+
+
+def _refresh(creds, form, layout):
+    counts, layout = _fetch_counts(creds, form, layout)
+    _store(form["form_id"], counts, layout)
+    return counts
+
+
+def _submit_refresh(creds, form, layout):
+    with _in_flight_lock:
+        future = _in_flight.get(form["form_id"])
+        if future is None or future.done():
+            future = _in_flight[form["form_id"]] = _get_executor().submit(_refresh, creds, form, layout)
+        return future
+
+
+def get_booking_counts(creds, forms):
+    conn = metadata_store.connect()
+    cached = {row["form_id"]: row for row in conn.execute("SELECT * FROM booking_counts").fetchall()}
+    now = time.time()
+
+    counts = {}
+    futures = {}
+    for form in forms:
+        row = cached.get(form["form_id"])
+        if row and now - row["fetched_at"] <= BOOKING_COUNTS_TTL_SECONDS:
+            counts[form["form_id"]] = json.loads(row["counts"])
+        elif form.get("sheet_url"):
+            layout = json.loads(row["layout"]) if row and row["layout"] else None
+            futures[form["form_id"]] = _submit_refresh(creds, form, layout)
+
+    # One parallel wave for every form whose cached counts expired, waited
+    # on for a bounded time. Refreshes still running finish and store their
+    # counts in the background; meanwhile the last known counts are shown.
+    done, _ = wait(futures.values(), timeout=DASHBOARD_COUNTS_WAIT_SECONDS)
+    for form_id, future in futures.items():
+        if future in done and future.exception() is None:
+            counts[form_id] = future.result()
+        elif form_id in cached:
+            counts[form_id] = json.loads(cached[form_id]["counts"])
+    return counts
+
+
+def invalidate(form_id):
+    with metadata_store.transaction() as conn:
+        conn.execute("UPDATE booking_counts SET fetched_at = 0 WHERE form_id = ?", (form_id,))
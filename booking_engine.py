@@ -0,0 +1,342 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime
+
+import booking_counts
+import credential_manager
+import metadata_store
+import sheet_mirror
+import submissions
+from form_builder import register_cancel_hook, sheet_id_from_url, with_linked_sheet
+from google_clients import get_service, execute
+from sheet_mirror import PHONE_HEADER
+from submissions import SLOT_HEADER, TIMESTAMP_FORMAT, TIMESTAMP_HEADER
+
+
+# Accepted bookings are written to the linked sheet in batches this often
+SHEET_APPEND_INTERVAL_SECONDS = float(os.environ.get("SHEET_APPEND_INTERVAL_SECONDS", "2"))
+SHEET_APPEND_BATCH = int(os.environ.get("SHEET_APPEND_BATCH", "500"))
+# A claim older than this is assumed to belong to a worker that died
+SHEET_APPEND_CLAIM_SECONDS = 120
+# Seats taken or freed through the Google Form are picked up this often
+CAPACITY_RESYNC_SECONDS = float(os.environ.get("CAPACITY_RESYNC_SECONDS", "300"))
+EMAIL_HEADER = "Email Address"
+NAME_HEADER = "Name"
+
+metadata_store.register_schema("""
+CREATE TABLE IF NOT EXISTS slot_capacity (
+    form_id TEXT NOT NULL,
+    slot TEXT NOT NULL,
+    capacity INTEGER NOT NULL,
+    booked INTEGER NOT NULL,
+    expiry REAL,
+    PRIMARY KEY (form_id, slot)
+);
+CREATE TABLE IF NOT EXISTS bookings (
+    booking_id TEXT PRIMARY KEY,
+    form_id TEXT NOT NULL,
+    slot TEXT NOT NULL,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    claim TEXT,
+    claimed_at REAL,
+    appended_at REAL
+);
+CREATE TABLE IF NOT EXISTS capacity_sync (
+    form_id TEXT PRIMARY KEY,
+    slots_key TEXT NOT NULL,
+    synced_at REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS bookings_phone ON bookings (form_id, phone);
+CREATE UNIQUE INDEX IF NOT EXISTS bookings_email ON bookings (form_id, email) WHERE email != '';
+CREATE INDEX IF NOT EXISTS bookings_pending ON bookings (appended_at) WHERE appended_at IS NULL;
+""")
+
+_appender = None
+_appender_lock = threading.Lock()
+_wake = threading.Event()
+
+
+class BookingRejected(ValueError):
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+
+def _expiry(slot):
+    try:
+        return datetime.strptime(slot.get("date", ""), "%Y-%m-%dT%H:%M").timestamp()
+    except ValueError:
+        return None
+
+
+def _slots_key(form):
+    return json.dumps([[s["name"], s["limit"], s.get("date", "")] for s in form["slots"]])
+
+
+def capacity_current(form):
+    # Read-only check, so page views don't queue behind the booking writers
+    row = metadata_store.connect().execute(
+        "SELECT slots_key, synced_at FROM capacity_sync WHERE form_id = ?", (form["form_id"],)
+    ).fetchone()
+    return (
+        row is not None and row["slots_key"] == _slots_key(form)
+        and time.time() - row["synced_at"] < CAPACITY_RESYNC_SECONDS
+    )
+
+
+def sync_capacity(creds, form):
+    # Limits and dates follow the metadata. Seats taken count what the sheet
+    # holds (Google Form bookings included) plus app bookings that weren't
+    # in the mirror when it was last read.
+    form_id = form["form_id"]
+    try:
+        state, table = with_linked_sheet(creds, form_id, lambda sheet_id: (
+            sheet_mirror.ensure_fresh(creds, sheet_id), submissions.load_table(creds, sheet_id)
+        ))
+    except ValueError:
+        # No responses sheet to count against yet
+        raise BookingRejected("Booking is not open yet.", "unavailable")
+    taken = submissions.slot_counts(table, {s["name"]: s["limit"] for s in form["slots"]})
+    names = [s["name"] for s in form["slots"]]
+    with metadata_store.transaction() as conn:
+        conn.execute(
+            f"DELETE FROM slot_capacity WHERE form_id = ? AND slot NOT IN ({','.join('?' * len(names))})",
+            [form_id] + names
+        )
+        conn.executemany(
+            """
+            INSERT INTO slot_capacity (form_id, slot, capacity, booked, expiry)
+            VALUES (?, ?, ?, ? + (
+                SELECT COUNT(*) FROM bookings
+                WHERE form_id = ? AND slot = ? AND (appended_at IS NULL OR appended_at > ?)
+            ), ?)
+            ON CONFLICT(form_id, slot) DO UPDATE SET
+                capacity = excluded.capacity, booked = excluded.booked, expiry = excluded.expiry
+            """,
+            [
+                (form_id, s["name"], int(s["limit"]), taken[s["name"]], form_id, s["name"], state["synced_at"], _expiry(s))
+                for s in form["slots"]
+            ]
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO capacity_sync (form_id, slots_key, synced_at) VALUES (?, ?, ?)",
+            (form_id, _slots_key(form), time.time())
+        )
+
+
+def availability(form_id):
+    rows = metadata_store.connect().execute(
+        "SELECT slot, capacity, booked, expiry FROM slot_capacity WHERE form_id = ?", (form_id,)
+    ).fetchall()
+    now = time.time()
+    return {
+        row["slot"]: {
+            "capacity": row["capacity"],
+            "booked": row["booked"],
+            "left": max(0, row["capacity"] - row["booked"]),
+            "open": row["booked"] < row["capacity"] and (row["expiry"] is None or row["expiry"] > now)
+        }
+        for row in rows
+    }
+
+
+def _booked_in_sheet(form_id, phone, email):
+    # Google Form bookings only exist in the sheet. Read from the mirror,
+    # which sync_capacity keeps about as fresh as the seat counts.
+    form = metadata_store.get_form(form_id)
+    state = sheet_mirror.get_state(sheet_id_from_url(form["sheet_url"])) if form and form.get("sheet_url") else None
+    if state is None:
+        return False
+    sheet_id, headers = state["sheet_id"], state["headers"]
+    rows = sheet_mirror.find_rows(sheet_id, [phone]).get(phone, [])
+    if email and EMAIL_HEADER in headers:
+        rows += sheet_mirror.find_rows_by_cell(sheet_id, headers.index(EMAIL_HEADER), email)
+    status_col = headers.index(submissions.STATUS_HEADER) if submissions.STATUS_HEADER in headers else -1
+    # A cancelled booking frees the phone and email again
+    return any(
+        not (0 <= status_col < len(cells) and submissions.normalize_status(cells[status_col]) == "cancelled")
+        for _, cells in rows
+    )
+
+
+def reserve(form_id, slot, name, email, phone):
+    # The capacity check and the increment are one conditional UPDATE, so
+    # concurrent requests can never push booked past capacity.
+    booking_id = uuid.uuid4().hex
+    now = time.time()
+    email = email.strip().lower()
+    phone = phone.strip()
+    if _booked_in_sheet(form_id, phone, email):
+        raise BookingRejected("You have already booked this class.", "duplicate")
+    try:
+        with metadata_store.transaction() as conn:
+            taken = conn.execute(
+                """
+                UPDATE slot_capacity SET booked = booked + 1
+                WHERE form_id = ? AND slot = ? AND booked < capacity AND (expiry IS NULL OR expiry > ?)
+                """,
+                (form_id, slot, now)
+            ).rowcount
+            if not taken:
+                row = conn.execute(
+                    "SELECT capacity, booked, expiry FROM slot_capacity WHERE form_id = ? AND slot = ?",
+                    (form_id, slot)
+                ).fetchone()
+                if row is None:
+                    raise BookingRejected("Unknown slot.", "unknown_slot")
+                if row["booked"] >= row["capacity"]:
+                    raise BookingRejected("This slot is full.", "full")
+                raise BookingRejected("This slot has closed.", "expired")
+            conn.execute(
+                "INSERT INTO bookings (booking_id, form_id, slot, name, email, phone, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (booking_id, form_id, slot, name.strip(), email, phone, now)
+            )
+    except sqlite3.IntegrityError:
+        # Same rule as the Apps Script: one booking per phone or email
+        raise BookingRejected("You have already booked this class.", "duplicate")
+
+    _ensure_appender()
+    _wake.set()
+    return booking_id
+
+
+def release_cancelled(form_id, outcomes):
+    # Frees the seat and the one-booking-per-phone slot of every booking
+    # cancelled from the dashboard. A booking still waiting for the appender
+    # isn't in the sheet yet, so it is cancelled here instead.
+    overrides = {}
+    stale_claim = time.time() - SHEET_APPEND_CLAIM_SECONDS
+    with metadata_store.transaction() as conn:
+        for phone, outcome in outcomes.items():
+            if outcome not in ("cancelled", "already_cancelled", "not_found"):
+                continue
+            query = "SELECT booking_id, slot FROM bookings WHERE form_id = ? AND phone = ?"
+            if outcome == "not_found":
+                # Not while the appender is writing it to the sheet
+                query += " AND appended_at IS NULL AND (claimed_at IS NULL OR claimed_at < ?)"
+                booking = conn.execute(query, (form_id, phone.strip(), stale_claim)).fetchone()
+            else:
+                booking = conn.execute(query, (form_id, phone.strip())).fetchone()
+            if booking is None:
+                continue
+            conn.execute("DELETE FROM bookings WHERE booking_id = ?", (booking["booking_id"],))
+            conn.execute(
+                "UPDATE slot_capacity SET booked = MAX(booked - 1, 0) WHERE form_id = ? AND slot = ?",
+                (form_id, booking["slot"])
+            )
+            if outcome == "not_found":
+                overrides[phone] = "cancelled"
+        if any(outcome == "cancelled" for outcome in outcomes.values()):
+            # Seats of Google Form bookings are counted from the sheet
+            conn.execute("DELETE FROM capacity_sync WHERE form_id = ?", (form_id,))
+    return overrides
+
+
+register_cancel_hook(release_cancelled)
+
+
+def _sheet_row(headers, booking):
+    values = {
+        TIMESTAMP_HEADER: datetime.fromtimestamp(booking["created_at"]).strftime(TIMESTAMP_FORMAT),
+        EMAIL_HEADER: booking["email"],
+        NAME_HEADER: booking["name"],
+        PHONE_HEADER: booking["phone"],
+        SLOT_HEADER: booking["slot"],
+    }
+    return [values.get(header, "") for header in headers]
+
+
+def _claim_pending():
+    # Every gunicorn worker runs an appender; claiming keeps two of them
+    # from appending the same booking.
+    claim = uuid.uuid4().hex
+    now = time.time()
+    with metadata_store.transaction() as conn:
+        conn.execute(
+            """
+            UPDATE bookings SET claim = ?, claimed_at = ? WHERE booking_id IN (
+                SELECT booking_id FROM bookings
+                WHERE appended_at IS NULL AND (claimed_at IS NULL OR claimed_at < ?)
+                ORDER BY created_at LIMIT ?
+            )
+            """,
+            (claim, now, now - SHEET_APPEND_CLAIM_SECONDS, SHEET_APPEND_BATCH)
+        )
+        return conn.execute("SELECT * FROM bookings WHERE claim = ? ORDER BY created_at", (claim,)).fetchall()
+
+
+def _append_pending(creds):
+    pending = _claim_pending()
+    by_form = {}
+    for booking in pending:
+        by_form.setdefault(booking["form_id"], []).append(booking)
+
+    sheets_service = get_service(creds, "sheets", "v4")
+    for form_id, form_bookings in by_form.items():
+        form = metadata_store.get_form(form_id)
+        if not form or not form.get("sheet_url"):
+            continue
+        sheet_id = sheet_id_from_url(form["sheet_url"])
+        # Ranges without a tab name address the responses tab
+        header_range = execute(sheets_service.spreadsheets().values().batchGet(
+            spreadsheetId=sheet_id,
+            ranges=["1:1"]
+        ))["valueRanges"][0]
+        headers = (header_range.get("values") or [[]])[0]
+        execute(sheets_service.spreadsheets().values().append(
+            spreadsheetId=sheet_id,
+            range="A1",
+            valueInputOption="RAW",
+            insertDataOption="INSERT_ROWS",
+            body={"values": [_sheet_row(headers, b) for b in form_bookings]}
+        ))
+        with metadata_store.transaction() as conn:
+            conn.executemany(
+                "UPDATE bookings SET appended_at = ? WHERE booking_id = ?",
+                [(time.time(), b["booking_id"]) for b in form_bookings]
+            )
+        booking_counts.invalidate(form_id)
+    return len(pending)
+
+
+def _append_loop():
+    while True:
+        _wake.wait(SHEET_APPEND_INTERVAL_SECONDS)
+        _wake.clear()
+        info = credential_manager.load_info()
+        if info is None:
+            continue
+        try:
+            # Keep going while full batches come back, then wait for more
+            while _append_pending(credential_manager.get_credentials(info)) >= SHEET_APPEND_BATCH:
+                pass
+        except Exception:
+            # Left pending; the claim expires and a later pass retries them
+            traceback.print_exc()
+        # Bookings arriving meanwhile go out together in the next append
+        time.sleep(SHEET_APPEND_INTERVAL_SECONDS)
+
+
+def _ensure_appender():
+    # One appender thread per process, started by the first booking
+    global _appender
+    with _appender_lock:
+        if _appender is None or not _appender.is_alive():
+            _appender = threading.Thread(target=_append_loop, name="sheet-append", daemon=True)
+            _appender.start()
+
+
+def unappended_bookings(form_id):
+    return metadata_store.connect().execute(
+        "SELECT slot, phone FROM bookings WHERE form_id = ? AND appended_at IS NULL", (form_id,)
+    ).fetchall()
+
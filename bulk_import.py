@@ -0,0 +1,181 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import metadata_store
+from form_builder import (
+    valid_slot_names,
+    copy_master_form,
+    configure_form,
+    form_metadata_entry,
+    wait_for_linked_sheet,
+    sheet_url_for
+)
+
+
+# Forms/Drive write quotas are per user, so a term's import runs a few
+# classes at a time rather than all at once.
+BULK_IMPORT_WORKERS = int(os.environ.get("BULK_IMPORT_WORKERS", "3"))
+CSV_COLUMNS = ["class_name", "slot_name", "slot_limit", "slot_date", "meet_link", "notes"]
+
+# One row per class ever imported. A class re-imported with the same
+# schedule picks up from its last finished step instead of copying a new form.
+metadata_store.register_schema("""
+CREATE TABLE IF NOT EXISTS bulk_import_rows (
+    import_key TEXT PRIMARY KEY,
+    class_name TEXT NOT NULL,
+    step TEXT NOT NULL,
+    form_id TEXT,
+    form_url TEXT,
+    edit_url TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+""")
+
+
+def _slot(name, limit, date, where):
+    try:
+        return {"name": name.strip(), "limit": int(str(limit).strip()), "date": str(date).strip()}
+    except ValueError:
+        raise ValueError(f"{where}: slot limit must be a number")
+
+
+def _parse_csv(text):
+    classes = {}
+    reader = csv.DictReader(io.StringIO(text))
+    missing = [c for c in CSV_COLUMNS[:4] if c not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"CSV is missing columns: {', '.join(missing)}")
+    for line, row in enumerate(reader, start=2):
+        class_name = (row.get("class_name") or "").strip()
+        if not class_name:
+            continue
+        form_info = classes.setdefault(class_name, {
+            "title": class_name,
+            "class_name": class_name,
+            "slots": [],
+            "meet_link": (row.get("meet_link") or "").strip(),
+            "notes": (row.get("notes") or "").strip()
+        })
+        if (row.get("slot_name") or "").strip():
+            form_info["slots"].append(_slot(row["slot_name"], row["slot_limit"], row["slot_date"], f"Line {line}"))
+    return list(classes.values())
+
+
+def _parse_json(text):
+    classes = []
+    for i, entry in enumerate(json.loads(text), start=1):
+        class_name = str(entry.get("class_name", "")).strip()
+        if not class_name:
+            raise ValueError(f"Class {i}: class_name is required")
+        classes.append({
+            "title": class_name,
+            "class_name": class_name,
+            "slots": [
+                _slot(s.get("name", ""), s.get("limit", 0), s.get("date", ""), f"Class {class_name}")
+                for s in entry.get("slots", [])
+            ],
+            "meet_link": str(entry.get("meet_link", "")).strip(),
+            "notes": str(entry.get("notes", "")).strip()
+        })
+    return classes
+
+
+def parse_schedule(filename, data):
+    text = data.decode("utf-8-sig")
+    if filename.lower().endswith(".json"):
+        classes = _parse_json(text)
+    else:
+        classes = _parse_csv(text)
+    for form_info in classes:
+        # Checked up front so a bad row never leaves an orphan form behind
+        try:
+            valid_slot_names(form_info["slots"])
+        except ValueError as e:
+            raise ValueError(f"{form_info['class_name']}: {e}")
+    return classes
+
+
+def import_key(form_info):
+    canonical = json.dumps(
+        {k: form_info.get(k) for k in ("class_name", "slots", "meet_link", "notes")},
+        sort_keys=True
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _get_row(key):
+    row = metadata_store.connect().execute(
+        "SELECT * FROM bulk_import_rows WHERE import_key = ?", (key,)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def _set_row(conn, key, class_name, **fields):
+    fields.setdefault("error", None)
+    fields["updated_at"] = time.time()
+    conn.execute(
+        "INSERT OR IGNORE INTO bulk_import_rows (import_key, class_name, step, updated_at) VALUES (?, ?, 'new', ?)",
+        (key, class_name, fields["updated_at"])
+    )
+    columns = ", ".join(f"{name} = ?" for name in fields)
+    conn.execute(f"UPDATE bulk_import_rows SET {columns} WHERE import_key = ?", (*fields.values(), key))
+
+
+def import_class(creds, form_info):
+    # Steps: new -> copied -> configured -> done. Each step's Google call is
+    # recorded before the next starts, so a retry resumes where it failed.
+    key = import_key(form_info)
+    class_name = form_info["class_name"]
+    row = _get_row(key) or {"step": "new"}
+    if row["step"] in ("configured", "done") and not metadata_store.get_form(row["form_id"]):
+        # The form was deleted since: import it afresh
+        row = {"step": "new"}
+    if row["step"] == "done":
+        return {"class_name": class_name, "status": "skipped", "form_id": row["form_id"]}
+
+    try:
+        if row["step"] == "new":
+            form_id = copy_master_form(creds, class_name)
+            with metadata_store.transaction() as conn:
+                _set_row(conn, key, class_name, step="copied", form_id=form_id)
+            row = _get_row(key)
+
+        form_id = row["form_id"]
+        if row["step"] == "copied":
+            form_url, edit_url = configure_form(creds, form_id, form_info)
+            # Metadata and the step marker land together or not at all
+            with metadata_store.transaction() as conn:
+                metadata_store.add_form(form_metadata_entry(form_info, form_id, form_url, edit_url))
+                _set_row(conn, key, class_name, step="configured", form_url=form_url, edit_url=edit_url)
+
+        sheet_id = wait_for_linked_sheet(creds, form_id)
+        with metadata_store.transaction() as conn:
+            if sheet_id:
+                metadata_store.update_form(form_id, sheet_url=sheet_url_for(sheet_id))
+            _set_row(conn, key, class_name, step="done")
+    except Exception as e:
+        with metadata_store.transaction() as conn:
+            _set_row(conn, key, class_name, error=str(e) or type(e).__name__)
+        return {"class_name": class_name, "status": "failed", "form_id": row.get("form_id"), "error": str(e)}
+    return {"class_name": class_name, "status": "created", "form_id": form_id, "sheet_id": sheet_id}
+
+
+def bulk_create_job(report, creds, classes):
+    total = len(classes)
+    results = []
+    report(f"0/{total} classes")
+    with ThreadPoolExecutor(max_workers=BULK_IMPORT_WORKERS, thread_name_prefix="bulk") as executor:
+        futures = [executor.submit(import_class, creds, form_info) for form_info in classes]
+        for future in as_completed(futures):
+            results.append(future.result())
+            failed = sum(1 for r in results if r["status"] == "failed")
+            report(f"{len(results)}/{total} classes, {failed} failed")
+    order = {form_info["class_name"]: i for i, form_info in enumerate(classes)}
+    results.sort(key=lambda r: order[r["class_name"]])
+    return results
@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+
+from google_clients import credential_key
+from utils import write_json_atomic
+
+try:
+    import fcntl
+except ImportError:
+    # Windows / the PyInstaller desktop build runs a single process, so the
+    # in-process lock below is all that is needed there.
+    fcntl = None
+
+
+CREDS_FILE = os.environ.get(
+    "GOOGLE_CREDS_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "google_creds.json")
+)
+# Tokens are refreshed this long before Google would reject them
+REFRESH_MARGIN_SECONDS = float(os.environ.get("CREDS_REFRESH_MARGIN_SECONDS", "300"))
+
+_lock = threading.Lock()
+_account_locks = {}
+_live = {}
+_file_cache = {"mtime": None, "info": None}
+
+
+def to_info(creds):
+    return {
+        "token": creds.token,
+        "refresh_token": creds.refresh_token,
+        "token_uri": creds.token_uri,
+        "client_id": creds.client_id,
+        "client_secret": creds.client_secret,
+        "scopes": creds.scopes,
+        "expiry": creds.expiry.isoformat() + "Z" if creds.expiry else None
+    }
+
+
+def load_info():
+    # Re-parsed only when the file changes, e.g. after another worker refreshed
+    try:
+        mtime = os.stat(CREDS_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _lock:
+        if _file_cache["mtime"] != mtime:
+            with open(CREDS_FILE, "r") as f:
+                _file_cache["info"] = json.load(f)
+            _file_cache["mtime"] = mtime
+        return _file_cache["info"]
+
+
+def save(creds):
+    info = to_info(creds)
+    write_json_atomic(CREDS_FILE, info)
+    return info
+
+
+def forget():
+    with _lock:
+        _live.clear()
+        _file_cache["mtime"] = None
+        _file_cache["info"] = None
+    if os.path.exists(CREDS_FILE):
+        os.remove(CREDS_FILE)
+
+
+@contextmanager
+def _refresh_lock(key):
+    with _lock:
+        account_lock = _account_locks.setdefault(key, threading.Lock())
+    with account_lock:
+        if fcntl is None:
+            yield
+            return
+        # Serializes refreshes across gunicorn workers sharing CREDS_FILE
+        with open(CREDS_FILE + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _expires_soon(creds):
+    if not creds.token or not creds.expiry:
+        return True
+    return creds.expiry - datetime.utcnow() < timedelta(seconds=REFRESH_MARGIN_SECONDS)
+
+
+def _adopt(creds, info):
+    # Take over a token another worker already refreshed and persisted
+    if not info or info.get("refresh_token") != creds.refresh_token or not info.get("expiry"):
+        return False
+    stored = Credentials.from_authorized_user_info(info)
+    if creds.expiry and stored.expiry <= creds.expiry:
+        return False
+    creds.token = stored.token
+    creds.expiry = stored.expiry
+    return True
+
+
+def get_credentials(info):
+    base = Credentials.from_authorized_user_info(info)
+    key = credential_key(base)
+    with _lock:
+        creds = _live.setdefault(key, base)
+
+    if _expires_soon(creds):
+        _adopt(creds, load_info())
+    if not _expires_soon(creds):
+        return creds
+
+    with _refresh_lock(key):
+        # Whoever held the lock before us may have refreshed already
+        if _expires_soon(creds) and not (_adopt(creds, load_info()) and not _expires_soon(creds)):
+            creds.refresh(Request())
+            save(creds)
+    return creds
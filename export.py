@@ -0,0 +1,182 @@
+import csv
+import io
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+import sheet_mirror
+from booking_engine import EMAIL_HEADER, NAME_HEADER
+from submissions import (
+    SLOT_HEADER, STATUS_HEADER, TIMESTAMP_HEADER, normalize_slot, normalize_status, status_matches
+)
+
+
+# Bytes buffered before a chunk is handed to the response
+EXPORT_CHUNK_BYTES = 64 * 1024
+_MAPPED_HEADERS = [TIMESTAMP_HEADER, NAME_HEADER, EMAIL_HEADER, sheet_mirror.PHONE_HEADER]
+ALL_FORMS_COLUMNS = ["Class", "Form ID"] + _MAPPED_HEADERS + ["Slot", STATUS_HEADER]
+# Leading characters Excel and Sheets read as the start of a formula
+_FORMULA_PREFIXES = ("=", "+", "-", "@")
+# Phone numbers and signed numbers start with + or - but can't call anything
+_NUMERIC = re.compile(r"[+-]?[\d .()-]+")
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def form_rows(sheet_id, state, slot="", status=""):
+    # Header row, then the sheet's rows as they are, filtered the way
+    # view_submissions filters them. Rows come off the mirror in batches.
+    columns = list(state["headers"])
+    if STATUS_HEADER not in columns:
+        columns.append(STATUS_HEADER)
+    width = len(columns)
+    slot_col = columns.index(SLOT_HEADER) if SLOT_HEADER in columns else -1
+    status_col = columns.index(STATUS_HEADER)
+
+    yield columns
+    for _, cells in sheet_mirror.iter_rows(sheet_id):
+        cells = list(cells[:width]) + [""] * (width - len(cells))
+        if slot and (slot_col == -1 or normalize_slot(cells[slot_col]) != slot):
+            continue
+        if not status_matches(normalize_status(cells[status_col]), status):
+            continue
+        yield cells
+
+
+def _cell(cells, index, header):
+    i = index.get(header, len(cells))
+    return cells[i] if i < len(cells) else ""
+
+
+def all_forms_rows(sources, slot="", status=""):
+    # Sheets don't share a column layout, so every class is mapped onto the
+    # same columns with the slot and status already normalized.
+    yield ALL_FORMS_COLUMNS
+    for form, sheet_id, state in sources:
+        index = {header: i for i, header in enumerate(state["headers"])}
+        for _, cells in sheet_mirror.iter_rows(sheet_id):
+            values = [_cell(cells, index, header) for header in _MAPPED_HEADERS]
+            row_slot = normalize_slot(_cell(cells, index, SLOT_HEADER))
+            row_status = normalize_status(_cell(cells, index, STATUS_HEADER))
+            if (slot and row_slot != slot) or not status_matches(row_status, status):
+                continue
+            yield [form["class_name"], form["form_id"]] + values + [row_slot, row_status]
+
+
+def _csv_cell(value):
+    # Student-entered text is quoted so a spreadsheet opening the CSV
+    # doesn't evaluate it as a formula.
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES) and not _NUMERIC.fullmatch(value):
+        return "'" + value
+    return value
+
+
+def stream_csv(rows):
+    # BOM so Excel opens non-ASCII names correctly
+    buffer = io.StringIO()
+    buffer.write("\ufeff")
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_csv_cell(value) for value in row])
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    # Write-only, unseekable target for ZipFile: it falls back to data
+    # descriptors, so entries never need to be rewound.
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+_XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Submissions" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'
+    ),
+}
+_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_TAIL = '</sheetData></worksheet>'
+# Control characters XML 1.0 can't carry
+_INVALID_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _xlsx_row(number, row):
+    # Everything as inline strings: phone numbers keep their leading digits
+    cells = "".join(
+        f'<c r="{sheet_mirror.column_letter(i)}{number}" t="inlineStr"><is><t xml:space="preserve">'
+        f'{escape(_INVALID_XML.sub("", str(value)))}</t></is></c>'
+        for i, value in enumerate(row) if value != ""
+    )
+    return f'<row r="{number}">{cells}</row>'
+
+
+def stream_xlsx(rows):
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in _XLSX_PARTS.items():
+            archive.writestr(name, data)
+        with archive.open("xl/worksheets/sheet1.xml", "w") as sheet:
+            sheet.write(_SHEET_HEAD.encode())
+            for number, row in enumerate(rows, start=1):
+                sheet.write(_xlsx_row(number, row).encode("utf-8"))
+                if sink.size >= EXPORT_CHUNK_BYTES:
+                    yield sink.drain()
+            sheet.write(_SHEET_TAIL.encode())
+    yield sink.drain()
+
+
+def stream(rows, fmt):
+    return stream_xlsx(rows) if fmt == "xlsx" else stream_csv(rows)
@@ -0,0 +1,380 @@
+"""In-memory stand-in for the Drive, Forms, Sheets and Apps Script APIs.
+
+Plugged in with google_clients.set_service_factory(fake.service). Only the
+calls this app makes are implemented, with the same request/execute shape
+as googleapiclient so execute(), batching and metrics work unchanged.
+"""
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+
+RESPONSE_HEADERS = ["Timestamp", "Email Address", "Mobile Number", "Choose a Slot"]
+A1_PART = re.compile(r"^([A-Z]*)(\d*)$")
+
+# HTTP verb per method, as in the discovery documents
+HTTP_METHODS = {
+    "drive.files.copy": "POST",
+    "drive.files.create": "POST",
+    "drive.files.get": "GET",
+    "drive.files.list": "GET",
+    "drive.files.delete": "DELETE",
+    "drive.permissions.create": "POST",
+    "forms.forms.get": "GET",
+    "forms.forms.batchUpdate": "POST",
+    "sheets.spreadsheets.get": "GET",
+    "sheets.spreadsheets.batchUpdate": "POST",
+    "sheets.spreadsheets.values.batchGet": "GET",
+    "sheets.spreadsheets.values.update": "PUT",
+    "sheets.spreadsheets.values.append": "POST",
+    "sheets.spreadsheets.values.batchUpdate": "POST",
+    "script.projects.create": "POST",
+    "script.projects.updateContent": "PUT",
+    "script.scripts.run": "POST",
+}
+
+
+def _not_found(what):
+    content = json.dumps({"error": {"code": 404, "message": f"{what} not found", "status": "NOT_FOUND"}})
+    return HttpError(httplib2.Response({"status": 404}), content.encode())
+
+
+def _bad_request(message):
+    content = json.dumps({"error": {"code": 400, "message": message, "status": "INVALID_ARGUMENT"}})
+    return HttpError(httplib2.Response({"status": 400}), content.encode())
+
+
+def _column_index(letters):
+    index = 0
+    for char in letters:
+        index = index * 26 + ord(char) - 64
+    return index - 1
+
+
+def parse_range(a1):
+    # "'Tab'!A1:B2", "Tab!2:1001", "1:1", "C:C" -> (tab or None, r1, c1, r2, c2);
+    # rows/columns are 0-based and None means unbounded.
+    tab = None
+    if "!" in a1:
+        tab, a1 = a1.rsplit("!", 1)
+        if tab.startswith("'"):
+            tab = tab[1:-1].replace("''", "'")
+    parts = a1.split(":")
+    bounds = []
+    for part in parts:
+        letters, digits = A1_PART.match(part).groups()
+        bounds.append((int(digits) - 1 if digits else None, _column_index(letters) if letters else None))
+    start, end = bounds[0], bounds[-1]
+    return tab, start[0], start[1], end[0], end[1]
+
+
+def _trim(rows):
+    # The Sheets API drops trailing empty cells and rows
+    trimmed = []
+    for row in rows:
+        while row and row[-1] in ("", None):
+            row = row[:-1]
+        trimmed.append(row)
+    while trimmed and not trimmed[-1]:
+        trimmed.pop()
+    return trimmed
+
+
+class FakeRequest:
+    def __init__(self, backend, method_id, kwargs):
+        self.backend = backend
+        self.methodId = method_id
+        self.method = HTTP_METHODS.get(method_id, "POST")
+        self.kwargs = kwargs
+        self.body = json.dumps(kwargs["body"]) if "body" in kwargs else None
+
+    def execute(self):
+        self.backend.pause()
+        return self.backend.call(self.methodId, self.kwargs)
+
+    def next_chunk(self):
+        # Resumable uploads finish in one chunk
+        return None, self.execute()
+
+
+class FakeBatch:
+    def __init__(self, backend, callback):
+        self.backend = backend
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id or str(len(self.requests)), request))
+
+    def execute(self):
+        self.backend.pause()
+        for request_id, request in self.requests:
+            try:
+                response, error = self.backend.call(request.methodId, request.kwargs), None
+            except HttpError as e:
+                response, error = None, e
+            self.callback(request_id, response, error)
+
+
+class FakeResource:
+    def __init__(self, backend, path):
+        self._backend = backend
+        self._path = path
+
+    def __getattr__(self, name):
+        path = f"{self._path}.{name}"
+
+        def call(**kwargs):
+            # Resource accessors take no arguments; API methods always do
+            if path == f"{self._path}.new_batch_http_request":
+                return FakeBatch(self._backend, kwargs.get("callback"))
+            if path in HTTP_METHODS:
+                return FakeRequest(self._backend, path, kwargs)
+            return FakeResource(self._backend, path)
+        return call
+
+
+class FakeGoogle:
+    def __init__(self, latency=0.0, jitter=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.lock = threading.RLock()
+        self.calls = Counter()
+        self.ids = itertools.count(1)
+        self.forms = {}
+        self.sheets = {}
+        self.files = {}
+        self.scripts = {}
+
+    def service(self, api, version):
+        return FakeResource(self, api)
+
+    def pause(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self.rng.uniform(0, self.jitter))
+
+    def _new_id(self, prefix):
+        return f"{prefix}{next(self.ids):06d}"
+
+    def call(self, method_id, kwargs):
+        with self.lock:
+            self.calls[method_id] += 1
+            handler = getattr(self, "_" + method_id.replace(".", "_"))
+            return handler(**kwargs)
+
+    # Seeding
+
+    def add_sheet(self, rows=(), headers=RESPONSE_HEADERS, title="Form Responses 1"):
+        with self.lock:
+            sheet_id = self._new_id("sheet")
+            self.sheets[sheet_id] = {"tabs": {title: [list(headers)] + [list(r) for r in rows]}, "hidden": set()}
+            self.files[sheet_id] = {"name": title, "trashed": False, "parents": []}
+            return sheet_id
+
+    def add_form(self, title="Form", sheet_id=None):
+        with self.lock:
+            form_id = self._new_id("form")
+            if sheet_id is None:
+                sheet_id = self.add_sheet()
+            self.forms[form_id] = {"title": title, "linkedSheetId": sheet_id, "revisionId": "1", "items": []}
+            self.files[form_id] = {"name": title, "trashed": False, "parents": []}
+            self.files[sheet_id]["parents"] = [form_id]
+            return form_id, sheet_id
+
+    def seed_bookings(self, count, slots, seed=0):
+        # Rows shaped like real form responses, with a few cancellations
+        rng = random.Random(seed)
+        start = datetime(2024, 1, 1)
+        rows = []
+        for i in range(count):
+            row = [
+                (start + timedelta(minutes=i)).strftime("%d/%m/%Y %H:%M:%S"),
+                f"student{i}@example.com",
+                f"9{rng.randrange(10 ** 9):09d}",
+                rng.choice(slots)
+            ]
+            if rng.random() < 0.05:
+                row.append("Cancelled")
+            rows.append(row)
+        return rows
+
+    # Drive
+
+    def _file(self, fileId):
+        entry = self.files.get(fileId)
+        if entry is None:
+            raise _not_found(f"File {fileId}")
+        return entry
+
+    def _drive_files_copy(self, fileId, body=None, **_):
+        # Every copy behaves like the master form: a fresh form whose
+        # response sheet is linked straight away.
+        form_id, _sheet_id = self.add_form((body or {}).get("name", "Copy"))
+        return {"id": form_id}
+
+    def _drive_files_create(self, body=None, media_body=None, **_):
+        file_id = self._new_id("file")
+        self.files[file_id] = {"name": (body or {}).get("name", ""), "trashed": False, "parents": []}
+        return {"id": file_id}
+
+    def _drive_files_get(self, fileId, fields=None, **_):
+        entry = self._file(fileId)
+        return {"id": fileId, "name": entry["name"], "trashed": entry["trashed"]}
+
+    def _drive_files_list(self, q="", **_):
+        match = re.match(r"'([^']+)' in parents", q)
+        parent = match.group(1) if match else None
+        return {"files": [
+            {"id": file_id, "name": entry["name"]}
+            for file_id, entry in self.files.items()
+            if file_id in self.sheets and (parent is None or parent in entry["parents"])
+        ]}
+
+    def _drive_files_delete(self, fileId, **_):
+        self._file(fileId)
+        del self.files[fileId]
+        self.forms.pop(fileId, None)
+        self.sheets.pop(fileId, None)
+        return {}
+
+    def _drive_permissions_create(self, fileId, body=None, **_):
+        self._file(fileId)
+        return {"id": "anyoneWithLink"}
+
+    # Forms
+
+    def _form(self, formId):
+        form = self.forms.get(formId)
+        if form is None:
+            raise _not_found(f"Form {formId}")
+        return form
+
+    def _forms_forms_get(self, formId, fields=None, **_):
+        form = self._form(formId)
+        return {"formId": formId, "linkedSheetId": form["linkedSheetId"], "revisionId": form["revisionId"]}
+
+    def _forms_forms_batchUpdate(self, formId, body, **_):
+        form = self._form(formId)
+        for change in body.get("requests", []):
+            if "updateFormInfo" in change:
+                form["title"] = change["updateFormInfo"]["info"].get("title", form["title"])
+            if "createItem" in change:
+                form["items"].insert(0, change["createItem"]["item"])
+        form["revisionId"] = str(int(form["revisionId"]) + 1)
+        return {"replies": [{} for _ in body.get("requests", [])]}
+
+    # Sheets
+
+    def _spreadsheet(self, spreadsheetId):
+        sheet = self.sheets.get(spreadsheetId)
+        if sheet is None:
+            raise _not_found(f"Spreadsheet {spreadsheetId}")
+        return sheet
+
+    def _tab(self, sheet, title):
+        if title is None:
+            return next(iter(sheet["tabs"].values()))
+        if title not in sheet["tabs"]:
+            raise _bad_request(f"Unable to parse range: {title}")
+        return sheet["tabs"][title]
+
+    def _sheets_spreadsheets_get(self, spreadsheetId, fields=None, **_):
+        sheet = self._spreadsheet(spreadsheetId)
+        return {"sheets": [
+            {"properties": {"title": title, "hidden": title in sheet["hidden"]}} for title in sheet["tabs"]
+        ]}
+
+    def _sheets_spreadsheets_batchUpdate(self, spreadsheetId, body, **_):
+        sheet = self._spreadsheet(spreadsheetId)
+        for change in body.get("requests", []):
+            if "addSheet" in change:
+                properties = change["addSheet"]["properties"]
+                sheet["tabs"][properties["title"]] = []
+                if properties.get("hidden"):
+                    sheet["hidden"].add(properties["title"])
+        return {"replies": [{} for _ in body.get("requests", [])]}
+
+    def _read(self, sheet, a1, major_dimension):
+        title, r1, c1, r2, c2 = parse_range(a1)
+        rows = self._tab(sheet, title)
+        r1 = r1 or 0
+        r2 = len(rows) - 1 if r2 is None else r2
+        selected = [list(row) for row in rows[r1:r2 + 1]]
+        if c1 is not None:
+            c2 = c1 if c2 is None else c2
+            selected = [row[c1:c2 + 1] for row in selected]
+        selected = _trim(selected)
+        if major_dimension == "COLUMNS":
+            width = max((len(row) for row in selected), default=0)
+            selected = _trim([
+                [row[col] if col < len(row) else "" for row in selected] for col in range(width)
+            ])
+        result = {"range": a1, "majorDimension": major_dimension}
+        if selected:
+            result["values"] = selected
+        return result
+
+    def _sheets_spreadsheets_values_batchGet(self, spreadsheetId, ranges, majorDimension="ROWS", **_):
+        sheet = self._spreadsheet(spreadsheetId)
+        return {
+            "spreadsheetId": spreadsheetId,
+            "valueRanges": [self._read(sheet, a1, majorDimension) for a1 in ranges]
+        }
+
+    def _write(self, sheet, a1, values):
+        title, r1, c1, _r2, _c2 = parse_range(a1)
+        rows = self._tab(sheet, title)
+        r1 = r1 or 0
+        c1 = c1 or 0
+        for i, new_row in enumerate(values):
+            while len(rows) <= r1 + i:
+                rows.append([])
+            row = rows[r1 + i]
+            row.extend([""] * (c1 + len(new_row) - len(row)))
+            row[c1:c1 + len(new_row)] = new_row
+        return sum(len(v) for v in values)
+
+    def _sheets_spreadsheets_values_update(self, spreadsheetId, range, body, **_):
+        sheet = self._spreadsheet(spreadsheetId)
+        return {"updatedCells": self._write(sheet, range, body["values"])}
+
+    def _sheets_spreadsheets_values_append(self, spreadsheetId, range, body, **_):
+        sheet = self._spreadsheet(spreadsheetId)
+        title = parse_range(range)[0]
+        rows = self._tab(sheet, title)
+        del rows[len(_trim(rows)):]
+        start = len(rows) + 1
+        rows.extend(list(row) for row in body["values"])
+        return {"updates": {"updatedRange": f"A{start}", "updatedRows": len(body["values"])}}
+
+    def _sheets_spreadsheets_values_batchUpdate(self, spreadsheetId, body, **_):
+        sheet = self._spreadsheet(spreadsheetId)
+        cells = sum(self._write(sheet, item["range"], item["values"]) for item in body.get("data", []))
+        return {"totalUpdatedCells": cells}
+
+    # Apps Script
+
+    def _script_projects_create(self, body, **_):
+        script_id = self._new_id("script")
+        self.scripts[script_id] = {"parentId": body.get("parentId"), "files": []}
+        return {"scriptId": script_id}
+
+    def _script_projects_updateContent(self, scriptId, body, **_):
+        if scriptId not in self.scripts:
+            raise _not_found(f"Script {scriptId}")
+        self.scripts[scriptId]["files"] = body.get("files", [])
+        return {"scriptId": scriptId, "files": self.scripts[scriptId]["files"]}
+
+    def _script_scripts_run(self, scriptId, body, **_):
+        if scriptId not in self.scripts:
+            raise _not_found(f"Script {scriptId}")
+        return {"done": True, "response": {"result": None}}
@@ -1,57 +1,68 @@
+import hashlib
 import json
-import os
+import threading
+import time
 from datetime import datetime
-from googleapiclient.discovery import build
+
+from googleapiclient.errors import HttpError
+
+import metadata_store
+import sheet_mirror
+from google_clients import get_service, execute
+from notify_gateway import script_settings
 
 
 MASTER_FORM_ID = "1XqnWTpsgR8gUyz2H7R_tWdlJVxZSj2xMd7cg4eEmwwo"
-METADATA_FILE = "forms.json"
+# Google caps an HTTP batch at 100 calls
+BATCH_LIMIT = 100
+
+metadata_store.register_schema("""
+CREATE TABLE IF NOT EXISTS form_resolution (
+    form_id TEXT PRIMARY KEY,
+    linked_sheet_id TEXT NOT NULL,
+    revision_id TEXT,
+    resolved_at REAL NOT NULL
+);
+""")
+
+_resolution_lock = threading.Lock()
+_resolution_stats = {"hits": 0, "misses": 0, "revalidations": 0}
+_cancel_hooks = []
 
 
 def load_form_metadata():
-    if not os.path.exists(METADATA_FILE):
-        return []
-    with open(METADATA_FILE, "r") as f:
-        return json.load(f)
+    return metadata_store.list_forms()
+
+
+def get_form_metadata(form_id):
+    return metadata_store.get_form(form_id)
 
 
 def save_form_metadata(new_entry):
-    data = load_form_metadata()
-    data.append(new_entry)
-    with open(METADATA_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    metadata_store.add_form(new_entry)
 
 
-def get_script_id_from_metadata(form_id):
-    data = load_form_metadata()
-    for entry in data:
-        if entry["form_id"] == form_id:
-            return entry.get("script_id")
-    return None
+def update_form_metadata(form_id, **fields):
+    return metadata_store.update_form(form_id, **fields)
 
 
-def update_metadata_script_id(form_id, script_id):
-    data = load_form_metadata()
-    for entry in data:
-        if entry["form_id"] == form_id:
-            entry["script_id"] = script_id
-    with open(METADATA_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+def delete_form_metadata(form_id):
+    return metadata_store.delete_form(form_id)
 
 
-def create_form_and_link_sheet(creds, form_info):
-    drive_service = build("drive", "v3", credentials=creds)
-    forms_service = build("forms", "v1", credentials=creds)
+def get_script_id_from_metadata(form_id):
+    entry = metadata_store.get_form(form_id)
+    return entry.get("script_id") if entry else None
+
+
+def update_metadata_script_id(form_id, script_id):
+    metadata_store.update_form(form_id, script_id=script_id)
 
-    copied_form = drive_service.files().copy(
-        fileId=MASTER_FORM_ID,
-        body={"name": f"{form_info['class_name']} Booking Form"}
-    ).execute()
-    form_id = copied_form["id"]
 
+def valid_slot_names(slots):
     slot_names = []
     today = datetime.now()
-    for slot in form_info["slots"]:
+    for slot in slots:
         slot_date = datetime.strptime(slot.get("date", ""), "%Y-%m-%dT%H:%M")
 
         if slot_date and slot_date < today:
@@ -62,8 +73,23 @@ def create_form_and_link_sheet(creds, form_info):
 
     if not slot_names:
         raise ValueError("No valid slots available to display.")
+    return slot_names
 
-    forms_service.forms().batchUpdate(formId=form_id, body={
+
+def copy_master_form(creds, class_name):
+    drive_service = get_service(creds, "drive", "v3")
+    copied_form = execute(drive_service.files().copy(
+        fileId=MASTER_FORM_ID,
+        body={"name": f"{class_name} Booking Form"}
+    ))
+    return copied_form["id"]
+
+
+def configure_form(creds, form_id, form_info):
+    forms_service = get_service(creds, "forms", "v1")
+    slot_names = valid_slot_names(form_info["slots"])
+
+    execute(forms_service.forms().batchUpdate(formId=form_id, body={
         "requests": [
             {
                 "updateFormInfo": {
@@ -90,12 +116,15 @@ def create_form_and_link_sheet(creds, form_info):
                 }
             }
         ]
-    }).execute()
+    }))
 
     form_url = f"https://docs.google.com/forms/d/{form_id}/viewform"
     edit_url = f"https://docs.google.com/forms/d/{form_id}/edit"
+    return form_url, edit_url
+
 
-    save_form_metadata({
+def form_metadata_entry(form_info, form_id, form_url, edit_url):
+    return {
         "class_name": form_info["class_name"],
         "form_id": form_id,
         "form_url": form_url,
@@ -104,48 +133,49 @@ def create_form_and_link_sheet(creds, form_info):
         "meet_link": form_info.get("meet_link", ""),
         "notes": form_info.get("notes", ""),
         "sheet_url": ""
-    })
-
-    return form_url, edit_url, form_id
-
-
-def inject_script_to_sheet(creds, sheet_id, form_title, form_edit_url, slot_limits_dict, form_id, meet_link, notes_url):
-    from googleapiclient.discovery import build
-    import json
+    }
 
-    drive_service = build("drive", "v3", credentials=creds)
-    script_service = build("script", "v1", credentials=creds)
 
-    # ✅ Check if script_id already exists
-    existing_script_id = get_script_id_from_metadata(form_id)
-
-    if existing_script_id:
-        project_id = existing_script_id
-        print(f"Updating existing script project: {project_id}")
-    else:
-        # Create new project first time
-        drive_service.files().get(fileId=sheet_id, fields="name").execute()
-        project = script_service.projects().create(body={
-            "title": f"{form_title} Script",
-            "parentId": sheet_id
-        }).execute()
-        project_id = project["scriptId"]
-        update_metadata_script_id(form_id, project_id)
-        print(f"Created new script project: {project_id}")
+def create_form_and_link_sheet(creds, form_info):
+    form_id = copy_master_form(creds, form_info["class_name"])
+    form_url, edit_url = configure_form(creds, form_id, form_info)
+    save_form_metadata(form_metadata_entry(form_info, form_id, form_url, edit_url))
+    return form_url, edit_url, form_id
 
-    # ✅ Convert Python data for JS
-    slot_limits_js = json.dumps(slot_limits_dict)
-    form_url_js = json.dumps(form_edit_url)
-    meet_link_js = json.dumps(meet_link)
-    notes_url_js = json.dumps(notes_url)
 
-    # ✅ Your Apps Script code
-    script_code = f"""
-function setupTrigger() {{
+# The script source is the same for every form; per-form settings live in a
+# hidden tab so editing them never needs a code upload.
+SCRIPT_TEMPLATE = r"""
+var PHONE_KEY = "idx_p_";
+var EMAIL_KEY = "idx_e_";
+var BOOKING_KEY = "idx_k_";
+var COUNT_KEY = "cnt_";
+var INDEX_READY = "index_ready";
+// Script properties are capped at 500 KB. Once the per-booking keys would
+// pass this, they are dropped and duplicates are found by scanning the
+// phone and email columns instead; slot counts stay in properties.
+var INDEX_MAX_BYTES = 400000;
+var INDEX_BYTES = "index_bytes";
+var INDEX_MODE = "index_mode";
+// Must match CONFIG_TAB in form_builder.py
+var CONFIG_SHEET = "_BookingConfig";
+var cachedConfig = null;
+
+// Per-form settings (slots, form URL, meet link, notes) pushed by the
+// dashboard as JSON; read once per execution.
+function config() {
+  if (cachedConfig === null) {
+    var sheet = SpreadsheetApp.getActiveSpreadsheet().getSheetByName(CONFIG_SHEET);
+    cachedConfig = JSON.parse(sheet.getRange("A1").getValue());
+  }
+  return cachedConfig;
+}
+
+function setupTrigger() {
   var triggers = ScriptApp.getProjectTriggers();
-  for (var i = 0; i < triggers.length; i++) {{
+  for (var i = 0; i < triggers.length; i++) {
     ScriptApp.deleteTrigger(triggers[i]);
-  }}
+  }
   ScriptApp.newTrigger("onFormSubmit")
     .forSpreadsheet(SpreadsheetApp.getActiveSpreadsheet())
     .onFormSubmit()
@@ -154,106 +184,275 @@ function setupTrigger() {{
     .timeBased()
     .everyMinutes(5)
     .create();
-}}
-
-function onFormSubmit(e) {{
-  var sheet = SpreadsheetApp.getActiveSpreadsheet().getActiveSheet();
-  var data = sheet.getDataRange().getValues();
-  var headers = data[0];
-
-  var phoneCol = headers.indexOf("Mobile Number");
-  var emailCol = headers.indexOf("Email Address");
-  var slotCol = headers.indexOf("Choose a Slot");
-  var statusCol = headers.indexOf("Status");
-
-  if (statusCol === -1) {{
-    sheet.getRange(1, headers.length + 1).setValue("Status");
-    statusCol = headers.length;
-  }}
-
-  var newRow = data[data.length - 1];
-  var newPhone = newRow[phoneCol];
-  var newEmail = newRow[emailCol];
-
-  var isDuplicate = false;
-
-  for (var i = 1; i < data.length - 1; i++) {{
-    var row = data[i];
-    var phone = row[phoneCol];
-    var email = row[emailCol];
-    if (phone === newPhone || email === newEmail) {{
-      isDuplicate = true;
-      break;
-    }}
-  }}
-
-  if (isDuplicate) {{
-    sheet.getRange(data.length, statusCol + 1).setValue("Duplicate");
-    return;
-  }}
-
+  ScriptApp.newTrigger("refreshSlots")
+    .timeBased()
+    .everyHours(1)
+    .create();
   refreshSlots();
-}}
+}
+
+function cellKey(value) {
+  return value === undefined ? "\u0000" : String(value);
+}
+
+function bookingKey(phone, email, slot) {
+  phone = phone ? phone.toString().trim() : "";
+  email = email ? email.toString().trim() : "";
+  return (phone + "_" + email + "_" + slot).toLowerCase();
+}
+
+function slotName(slotRaw) {
+  return slotRaw.toString().replace(/\s*\(.*\)/, "").trim();
+}
+
+function isBookingKey(key) {
+  return key.indexOf(PHONE_KEY) === 0 || key.indexOf(EMAIL_KEY) === 0 || key.indexOf(BOOKING_KEY) === 0;
+}
+
+function isIndexKey(key) {
+  return isBookingKey(key) || key.indexOf(COUNT_KEY) === 0 || key === INDEX_BYTES || key === INDEX_MODE;
+}
+
+function scanMode(props) {
+  return props.getProperty(INDEX_MODE) === "scan";
+}
+
+function seenBefore(sheet, rowIndex, col, value) {
+  if (rowIndex <= 2) return false;
+  // A missing column reads as undefined on every row, as in the index
+  if (col === -1) return true;
+  var target = cellKey(value);
+  var values = sheet.getRange(2, col + 1, rowIndex - 2, 1).getValues();
+  for (var i = 0; i < values.length; i++) {
+    if (cellKey(values[i][0]) === target) return true;
+  }
+  return false;
+}
+
+function switchToScan(props) {
+  var all = props.getProperties();
+  var kept = {};
+  for (var name in all) {
+    if (!isBookingKey(name) && name !== INDEX_BYTES) kept[name] = all[name];
+  }
+  kept[INDEX_MODE] = "scan";
+  props.setProperties(kept, true);
+}
+
+// Writes index updates, falling back to column scans when the properties
+// would outgrow INDEX_MAX_BYTES or the write is refused.
+function writeIndex(props, updates) {
+  if (!scanMode(props)) {
+    var bytes = parseInt(props.getProperty(INDEX_BYTES) || "0");
+    for (var key in updates) {
+      if (isBookingKey(key) && props.getProperty(key) === null) bytes += key.length + updates[key].length;
+    }
+    if (bytes <= INDEX_MAX_BYTES) {
+      updates[INDEX_BYTES] = String(bytes);
+      try {
+        props.setProperties(updates);
+        return;
+      } catch (err) {
+        console.error("Booking index write failed, switching to column scans: " + err);
+      }
+    }
+    switchToScan(props);
+  }
+  var counts = {};
+  for (var key in updates) {
+    if (key.indexOf(COUNT_KEY) === 0) counts[key] = updates[key];
+  }
+  props.setProperties(counts);
+}
+
+// Duplicate detection and slot counts are kept incrementally in script
+// properties, so a submission only reads the header and its own row (plus
+// the phone and email columns once the index is in scan mode).
+function onFormSubmit(e) {
+  var sheet = e && e.range ? e.range.getSheet() : SpreadsheetApp.getActiveSpreadsheet().getActiveSheet();
+  var lock = LockService.getScriptLock();
+  lock.waitLock(30000);
+  try {
+    var headers = sheet.getRange(1, 1, 1, sheet.getLastColumn()).getValues()[0];
+    var phoneCol = headers.indexOf("Mobile Number");
+    var emailCol = headers.indexOf("Email Address");
+    var slotCol = headers.indexOf("Choose a Slot");
+    var statusCol = headers.indexOf("Status");
+
+    if (statusCol === -1) {
+      sheet.getRange(1, headers.length + 1).setValue("Status");
+      statusCol = headers.length;
+    }
+
+    var rowIndex = e && e.range ? e.range.getRow() : sheet.getLastRow();
+    var newRow = sheet.getRange(rowIndex, 1, 1, headers.length).getValues()[0];
+
+    var props = PropertiesService.getScriptProperties();
+    if (props.getProperty(INDEX_READY) !== "1") {
+      reconcileIndex(rowIndex);
+    }
+
+    var scan = scanMode(props);
+    var phoneKey = PHONE_KEY + cellKey(newRow[phoneCol]);
+    var emailKey = EMAIL_KEY + cellKey(newRow[emailCol]);
+    var isDuplicate = scan
+      ? seenBefore(sheet, rowIndex, phoneCol, newRow[phoneCol]) || seenBefore(sheet, rowIndex, emailCol, newRow[emailCol])
+      : props.getProperty(phoneKey) !== null || props.getProperty(emailKey) !== null;
+
+    var updates = {};
+    if (!scan) {
+      updates[phoneKey] = "1";
+      updates[emailKey] = "1";
+    }
+
+    if (isDuplicate) {
+      writeIndex(props, updates);
+      sheet.getRange(rowIndex, statusCol + 1).setValue("Duplicate");
+      return;
+    }
+
+    var slotRaw = slotCol !== -1 ? newRow[slotCol] : "";
+    if (slotRaw) {
+      var slot = slotName(slotRaw);
+      var key = BOOKING_KEY + bookingKey(newRow[phoneCol], newRow[emailCol], slot);
+      // A new phone can't have a booking key yet, so scan mode just counts
+      if (scan || props.getProperty(key) === null) {
+        if (!scan) updates[key] = "1";
+        updates[COUNT_KEY + slot] = String(parseInt(props.getProperty(COUNT_KEY + slot) || "0") + 1);
+      }
+    }
+    writeIndex(props, updates);
+    if (slotRaw) reopenExpiredSlot(slotName(slotRaw));
+  } finally {
+    lock.releaseLock();
+  }
+
+  updateSlotChoices(readSlotCounts());
+}
+
+// Slots whose expiry notifications went out, as slot -> expiry (ms). Keyed by
+// expiry so moving a slot's date re-arms it.
+var EXPIRY_DONE = "expiry_done";
+
+function expirySchedule() {
+  var limits = config().slots;
+  var schedule = {};
+  for (var slot in limits) {
+    schedule[slot] = new Date(limits[slot].expiry).getTime();
+  }
+  return schedule;
+}
+
+function reopenExpiredSlot(slot) {
+  // A booking landed in a slot that already expired: let the next trigger
+  // run pick it up.
+  var schedule = expirySchedule();
+  if (schedule[slot] === undefined || Date.now() < schedule[slot]) return;
+  var props = PropertiesService.getScriptProperties();
+  var done = JSON.parse(props.getProperty(EXPIRY_DONE) || "{}");
+  if (done[slot] === undefined) return;
+  delete done[slot];
+  props.setProperty(EXPIRY_DONE, JSON.stringify(done));
+}
+
+function notificationUrl(phone) {
+  var gateway = config().gateway;
+  var url = gateway.url
+    + "?user=" + encodeURIComponent(gateway.user)
+    + "&pass=" + encodeURIComponent(gateway.pass)
+    + "&sender=" + encodeURIComponent(gateway.sender)
+    + "&phone=" + encodeURIComponent(phone)
+    + "&priority=wa"
+    + "&stype=normal";
+
+  var meetLink = config().meetLink;
+  var notesUrl = config().notesUrl;
+
+  if (meetLink && notesUrl) {
+    url += "&text=bookmeet"
+      + "&htype=document"
+      + "&fname=" + encodeURIComponent("notes.pdf")
+      + "&url=" + encodeURIComponent(notesUrl)
+      + "&Params=" + encodeURIComponent(meetLink);
+  } else if (meetLink && !notesUrl) {
+    url += "&text=" + encodeURIComponent("meet " + meetLink);
+  } else {
+    url += "&text=" + encodeURIComponent("tex1");
+  }
+  return url;
+}
+
+function onTimeTrigger() {
+  // The dashboard's notification outbox sends these unless told otherwise
+  if (!config().notifyFromScript) return;
+  var now = Date.now();
+  var schedule = expirySchedule();
+  var props = PropertiesService.getScriptProperties();
+  var done = JSON.parse(props.getProperty(EXPIRY_DONE) || "{}");
+
+  // Cheap exit: nothing has expired since the last run
+  var due = {};
+  var anyDue = false;
+  for (var slot in schedule) {
+    if (now >= schedule[slot] && done[slot] !== schedule[slot]) {
+      due[slot] = true;
+      anyDue = true;
+    }
+  }
+  if (!anyDue) return;
 
-function onTimeTrigger() {{
-  var now = new Date();
   var sheet = SpreadsheetApp.getActiveSpreadsheet().getActiveSheet();
   var data = sheet.getDataRange().getValues();
-  if (data.length < 2) return;
-
   var headers = data[0];
   var phoneCol = headers.indexOf("Mobile Number");
   var notifiedCol = headers.indexOf("ExpiryNotified");
   var slotCol = headers.indexOf("Choose a Slot");
 
-  if (notifiedCol === -1) {{
+  if (notifiedCol === -1) {
     sheet.getRange(1, headers.length + 1).setValue("ExpiryNotified");
     notifiedCol = headers.length;
-  }}
-
-  var limits = {slot_limits_js};
+  }
 
-  for (var i = 1; i < data.length; i++) {{
+  var requests = [];
+  var pendingRows = [];
+  for (var i = 1; i < data.length; i++) {
     var row = data[i];
     var phone = row[phoneCol];
     var slotRaw = row[slotCol];
     if (!phone || !slotRaw) continue;
-
-    var slot = slotRaw.toString().replace(/\\s*\\(.*\\)/, "").trim();
-    if (!limits[slot]) continue;
-
-    var expiry = new Date(limits[slot].expiry);
-    if (now >= expiry && row[notifiedCol] !== "YES") {{
-      var url = "https://bhashsms.com/api/sendmsgutil.php"
-        + "?user=RCclasses_BW"
-        + "&pass=123456"
-        + "&sender=BUZWAP"
-        + "&phone=" + encodeURIComponent(phone)
-        + "&priority=wa"
-        + "&stype=normal";
-
-      var meetLink = {meet_link_js};
-      var notesUrl = {notes_url_js};
-
-      if (meetLink && notesUrl) {{
-        url += "&text=bookmeet"
-          + "&htype=document"
-          + "&fname=" + encodeURIComponent("notes.pdf")
-          + "&url=" + encodeURIComponent(notesUrl)
-          + "&Params=" + encodeURIComponent(meetLink);
-      }} else if (meetLink && !notesUrl) {{
-        url += "&text=" + encodeURIComponent("meet " + meetLink);
-      }} else {{
-        url += "&text=" + encodeURIComponent("tex1");
-      }}
-
-      UrlFetchApp.fetch(url);
-      sheet.getRange(i + 1, notifiedCol + 1).setValue("YES");
-    }}
-  }}
-}}
-
-function refreshSlots() {{
+    if (!due[slotName(slotRaw)] || row[notifiedCol] === "YES") continue;
+    requests.push({ url: notificationUrl(phone), muteHttpExceptions: true });
+    pendingRows.push(i);
+  }
+
+  var failed = {};
+  if (requests.length > 0) {
+    var responses = UrlFetchApp.fetchAll(requests);
+    var column = [];
+    for (var i = 1; i < data.length; i++) {
+      column.push([notifiedCol < data[i].length ? data[i][notifiedCol] : ""]);
+    }
+    for (var k = 0; k < responses.length; k++) {
+      var rowIndex = pendingRows[k];
+      if (responses[k].getResponseCode() < 400) {
+        column[rowIndex - 1] = ["YES"];
+      } else {
+        failed[slotName(data[rowIndex][slotCol])] = true;
+      }
+    }
+    sheet.getRange(2, notifiedCol + 1, column.length, 1).setValues(column);
+  }
+
+  // Failed sends keep their slot due so the next run retries them
+  for (var slot in due) {
+    if (!failed[slot]) done[slot] = schedule[slot];
+  }
+  props.setProperty(EXPIRY_DONE, JSON.stringify(done));
+}
+
+// Full rescan: rebuilds the incremental index from the sheet. Runs hourly
+// and from the dashboard's Refresh Slots, which also picks up cancellations.
+function reconcileIndex(stopRow) {
   var sheet = SpreadsheetApp.getActiveSpreadsheet().getActiveSheet();
   var data = sheet.getDataRange().getValues();
   var headers = data[0];
@@ -261,159 +460,550 @@ function refreshSlots() {{
   var phoneCol = headers.indexOf("Mobile Number");
   var emailCol = headers.indexOf("Email Address");
   var statusCol = headers.indexOf("Status");
-  if (slotCol === -1) return;
+  var end = stopRow ? Math.min(stopRow - 1, data.length) : data.length;
 
-  var counts = {{}};
-  var uniqueSet = {{}};
+  var index = {};
+  var counts = {};
 
-  for (var i = 1; i < data.length; i++) {{
+  for (var i = 1; i < end; i++) {
     var row = data[i];
-    var slotRaw = row[slotCol];
-    var phone = row[phoneCol] ? row[phoneCol].toString().trim() : "";
-    var email = row[emailCol] ? row[emailCol].toString().trim() : "";
+    index[PHONE_KEY + cellKey(row[phoneCol])] = "1";
+    index[EMAIL_KEY + cellKey(row[emailCol])] = "1";
+
+    var slotRaw = slotCol !== -1 ? row[slotCol] : "";
     var status = statusCol !== -1 ? row[statusCol] : "";
     if (!slotRaw || status === "Cancelled" || status === "Duplicate") continue;
 
-    var slot = slotRaw.toString().replace(/\\s*\\(.*\\)/, "").trim();
-    var key = (phone + "_" + email + "_" + slot).toLowerCase();
-    if (uniqueSet[key]) continue;
+    var slot = slotName(slotRaw);
+    var key = BOOKING_KEY + bookingKey(row[phoneCol], row[emailCol], slot);
+    if (index[key]) continue;
 
-    uniqueSet[key] = true;
+    index[key] = "1";
     counts[slot] = (counts[slot] || 0) + 1;
-  }}
+  }
+
+  var bytes = 0;
+  for (var name in index) {
+    bytes += name.length + index[name].length;
+  }
+  var props = PropertiesService.getScriptProperties();
+  var all = props.getProperties();
+  var kept = {};
+  for (var name in all) {
+    if (!isIndexKey(name)) kept[name] = all[name];
+  }
+  for (var slot in counts) {
+    kept[COUNT_KEY + slot] = String(counts[slot]);
+  }
+  kept[INDEX_READY] = "1";
+
+  var written = false;
+  if (bytes <= INDEX_MAX_BYTES) {
+    for (var name in index) {
+      if (isBookingKey(name)) kept[name] = index[name];
+    }
+    kept[INDEX_BYTES] = String(bytes);
+    try {
+      props.setProperties(kept, true);
+      written = true;
+    } catch (err) {
+      console.error("Booking index write failed, switching to column scans: " + err);
+      for (var name in index) {
+        delete kept[name];
+      }
+      delete kept[INDEX_BYTES];
+    }
+  }
+  if (!written) {
+    // Too big for script properties: keep only the counts
+    kept[INDEX_MODE] = "scan";
+    props.setProperties(kept, true);
+  }
 
   Logger.log("Slot counts: " + JSON.stringify(counts));
-
-  var limits = {slot_limits_js};
-
-  var form = FormApp.openByUrl({form_url_js});
+  return counts;
+}
+
+function readSlotCounts() {
+  var props = PropertiesService.getScriptProperties();
+  var limits = config().slots;
+  var counts = {};
+  for (var slot in limits) {
+    counts[slot] = parseInt(props.getProperty(COUNT_KEY + slot) || "0");
+  }
+  return counts;
+}
+
+function refreshSlots() {
+  var lock = LockService.getScriptLock();
+  lock.waitLock(30000);
+  var counts;
+  try {
+    counts = reconcileIndex();
+  } finally {
+    lock.releaseLock();
+  }
+  updateSlotChoices(counts);
+}
+
+function updateSlotChoices(counts) {
+  var limits = config().slots;
+
+  var form = FormApp.openByUrl(config().formUrl);
   var items = form.getItems(FormApp.ItemType.MULTIPLE_CHOICE);
   var slotQuestion = null;
-  for (var i = 0; i < items.length; i++) {{
-    if (items[i].getTitle().toLowerCase().indexOf("slot") !== -1) {{
+  for (var i = 0; i < items.length; i++) {
+    if (items[i].getTitle().toLowerCase().indexOf("slot") !== -1) {
       slotQuestion = items[i].asMultipleChoiceItem();
       break;
-    }}
-  }}
+    }
+  }
   if (!slotQuestion) return;
 
   var choices = [];
   var now = new Date();
-  for (var slot in limits) {{
+  for (var slot in limits) {
     var data = limits[slot];
     var limit = parseInt(data.limit);
     var expiry = new Date(data.expiry);
     var current = counts[slot] || 0;
-    if (now <= expiry && current < limit) {{
+    if (now <= expiry && current < limit) {
       choices.push(slotQuestion.createChoice(slot + " (" + (limit - current) + " left)", true));
-    }}
-  }}
+    }
+  }
 
-  if (choices.length === 0) {{
+  if (choices.length === 0) {
     choices.push(slotQuestion.createChoice("No slots available", false));
-  }}
+  }
 
   slotQuestion.setChoices(choices);
   form.setAcceptingResponses(choices.length > 0);
-}}
+}
 """
 
+SCRIPT_MANIFEST = '{ "timeZone": "Asia/Kolkata", "exceptionLogging": "STACKDRIVER" }'
+SCRIPT_HASH = hashlib.sha256((SCRIPT_TEMPLATE + SCRIPT_MANIFEST).encode()).hexdigest()
+CONFIG_TAB = "_BookingConfig"
+
+
+def script_config(form_edit_url, slot_limits_dict, meet_link, notes_url):
+    config = {
+        "slots": slot_limits_dict,
+        "formUrl": form_edit_url,
+        "meetLink": meet_link,
+        "notesUrl": notes_url
+    }
+    config.update(script_settings())
+    return config
 
-    # Manifest
-    manifest = '{ "timeZone": "Asia/Kolkata", "exceptionLogging": "STACKDRIVER" }'
 
-    # ✅ Update content
-    script_service.projects().updateContent(
-        scriptId=project_id,
-        body={
-            "files": [
-                {"name": "Code", "type": "SERVER_JS", "source": script_code},
-                {"name": "appsscript", "type": "JSON", "source": manifest}
-            ]
-        }
-    ).execute()
+def push_script_config(creds, sheet_id, config):
+    sheets_service = get_service(creds, "sheets", "v4")
+    update = sheets_service.spreadsheets().values().update(
+        spreadsheetId=sheet_id,
+        range=f"{sheet_mirror.quote_tab(CONFIG_TAB)}!A1",
+        valueInputOption="RAW",
+        body={"values": [[json.dumps(config)]]}
+    )
+    try:
+        execute(update)
+    except HttpError as e:
+        if e.resp.status != 400:
+            raise
+        # First push for this sheet: the config tab does not exist yet
+        execute(sheets_service.spreadsheets().batchUpdate(spreadsheetId=sheet_id, body={
+            "requests": [{"addSheet": {"properties": {"title": CONFIG_TAB, "hidden": True}}}]
+        }))
+        execute(update)
+
+
+def inject_script_to_sheet(creds, sheet_id, form_title, form_edit_url, slot_limits_dict, form_id, meet_link, notes_url):
+    drive_service = get_service(creds, "drive", "v3")
+    script_service = get_service(creds, "script", "v1")
+    entry = get_form_metadata(form_id) or {}
+
+    # ✅ Check if script_id already exists
+    existing_script_id = entry.get("script_id")
+
+    if existing_script_id:
+        project_id = existing_script_id
+        print(f"Updating existing script project: {project_id}")
+    else:
+        # Create new project first time
+        execute(drive_service.files().get(fileId=sheet_id, fields="name"))
+        project = execute(script_service.projects().create(body={
+            "title": f"{form_title} Script",
+            "parentId": sheet_id
+        }))
+        project_id = project["scriptId"]
+        update_metadata_script_id(form_id, project_id)
+        entry = {}
+        print(f"Created new script project: {project_id}")
+
+    # Only what changed goes out: usually just the small config write
+    config = script_config(form_edit_url, slot_limits_dict, meet_link, notes_url)
+    config_hash = hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+    if (entry.get("config_hash") != config_hash or entry.get("config_sheet_id") != sheet_id
+            or entry.get("notify_from_script") != config["notifyFromScript"]):
+        push_script_config(creds, sheet_id, config)
+        # The outbox goes by what the sheet was told, not the current env
+        update_form_metadata(form_id, config_hash=config_hash, config_sheet_id=sheet_id,
+                             notify_from_script=config["notifyFromScript"])
+
+    if entry.get("script_hash") != SCRIPT_HASH:
+        execute(script_service.projects().updateContent(
+            scriptId=project_id,
+            body={
+                "files": [
+                    {"name": "Code", "type": "SERVER_JS", "source": SCRIPT_TEMPLATE},
+                    {"name": "appsscript", "type": "JSON", "source": SCRIPT_MANIFEST}
+                ]
+            }
+        ))
+        update_form_metadata(form_id, script_hash=SCRIPT_HASH)
+        print(f"Uploaded script code to {project_id}")
 
     return project_id
 
 
+def inject_form_script(creds, form_id):
+    target = get_form_metadata(form_id)
+    if not target:
+        raise ValueError("Form not found.")
+    slot_limits = {s["name"]: {"limit": s["limit"], "expiry": s["date"]} for s in target["slots"]}
+    script_id = with_linked_sheet(creds, form_id, lambda sheet_id: inject_script_to_sheet(
+        creds,
+        sheet_id,
+        target["class_name"],
+        target["form_edit_url"],
+        slot_limits,
+        form_id,
+        target.get("meet_link", ""),
+        target.get("notes", "")
+    ))
+    update_metadata_script_id(form_id, script_id)
+    return script_id
+
+
 def trigger_form_refresh(creds, script_id):
-    script_service = build("script", "v1", credentials=creds)
-    script_service.scripts().run(
+    script_service = get_service(creds, "script", "v1")
+    execute(script_service.scripts().run(
         scriptId=script_id,
         body={"function": "refreshSlots"}
-    ).execute()
-def get_linked_sheet_id_from_form(creds, form_id):
-    forms_service = build("forms", "v1", credentials=creds)
-    res = forms_service.forms().get(formId=form_id).execute()
+    ))
+
+
+def _count_resolution(outcome):
+    with _resolution_lock:
+        _resolution_stats[outcome] += 1
+
+
+def resolution_cache_stats():
+    with _resolution_lock:
+        return dict(_resolution_stats)
+
+
+def get_linked_sheet_id_from_form(creds, form_id, refresh=False):
+    # The linked sheet practically never changes, so the Forms API is only
+    # asked again after a not-found error (see with_linked_sheet).
+    if not refresh:
+        row = metadata_store.connect().execute(
+            "SELECT linked_sheet_id FROM form_resolution WHERE form_id = ?", (form_id,)
+        ).fetchone()
+        if row:
+            _count_resolution("hits")
+            return row["linked_sheet_id"]
+    _count_resolution("misses")
+
+    forms_service = get_service(creds, "forms", "v1")
+    res = execute(forms_service.forms().get(formId=form_id, fields="linkedSheetId,revisionId"))
     linkedSheetId = res.get("linkedSheetId")
     if not linkedSheetId:
         raise ValueError("No linked Sheet found. Please create it first in Google Forms.")
+    with metadata_store.transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO form_resolution (form_id, linked_sheet_id, revision_id, resolved_at) "
+            "VALUES (?, ?, ?, ?)",
+            (form_id, linkedSheetId, res.get("revisionId"), time.time())
+        )
     return linkedSheetId
-def cancel_booking_by_phone(creds, form_id, phone):
-    sheets_service = build("sheets", "v4", credentials=creds)
-    sheet_id = get_linked_sheet_id_from_form(creds, form_id)
-    if not sheet_id:
-        return "Linked sheet not found."
 
-    # Get sheet metadata to get the sheet/tab name
-    spreadsheet = sheets_service.spreadsheets().get(spreadsheetId=sheet_id).execute()
-    sheet_title = spreadsheet["sheets"][0]["properties"]["title"]
 
-    # Read values
-    result = sheets_service.spreadsheets().values().get(
+def invalidate_linked_sheet(form_id):
+    with metadata_store.transaction() as conn:
+        conn.execute("DELETE FROM form_resolution WHERE form_id = ?", (form_id,))
+
+
+def wait_for_linked_sheet(creds, form_id, timeout=60, initial_delay=1.0, max_delay=8.0):
+    # The copied form's response sheet appears a few seconds after the copy
+    deadline = time.time() + timeout
+    delay = initial_delay
+    while True:
+        try:
+            return get_linked_sheet_id_from_form(creds, form_id)
+        except ValueError:
+            if time.time() + delay > deadline:
+                return None
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+
+def sheet_url_for(sheet_id):
+    return f"https://docs.google.com/spreadsheets/d/{sheet_id}/edit"
+
+
+def sheet_id_from_url(sheet_url):
+    return sheet_url.split("/d/")[1].split("/")[0]
+
+
+def get_sheet_id_for_form(creds, form_id, refresh=False):
+    entry = get_form_metadata(form_id)
+    if entry and entry.get("sheet_url") and not refresh:
+        _count_resolution("hits")
+        return sheet_id_from_url(entry["sheet_url"])
+    sheet_id = get_linked_sheet_id_from_form(creds, form_id, refresh=refresh)
+    if entry and entry.get("sheet_url") != sheet_url_for(sheet_id):
+        update_sheet_url_in_metadata(form_id, sheet_url_for(sheet_id))
+    return sheet_id
+
+
+def with_linked_sheet(creds, form_id, fn):
+    sheet_id = get_sheet_id_for_form(creds, form_id)
+    try:
+        return fn(sheet_id)
+    except HttpError as e:
+        if e.resp.status != 404:
+            raise
+    # The stored sheet is gone: ask the Forms API once and retry
+    _count_resolution("revalidations")
+    fresh_id = get_sheet_id_for_form(creds, form_id, refresh=True)
+    if fresh_id == sheet_id:
+        raise ValueError("Linked sheet not found.")
+    return fn(fresh_id)
+
+
+def register_cancel_hook(hook):
+    # hook(form_id, outcomes) runs after every cancel and returns outcomes
+    # to override, e.g. for bookings that only exist outside the sheet
+    _cancel_hooks.append(hook)
+
+
+def cancel_bookings(creds, form_id, phones):
+    outcomes = with_linked_sheet(creds, form_id, lambda sheet_id: _cancel_bookings_in_sheet(creds, sheet_id, phones))
+    for hook in _cancel_hooks:
+        outcomes.update(hook(form_id, outcomes))
+    script_id = (get_form_metadata(form_id) or {}).get("script_id")
+    if script_id and "cancelled" in outcomes.values():
+        # The live form keeps a slot closed until the script recounts it
+        try:
+            trigger_form_refresh(creds, script_id)
+        except HttpError as e:
+            # The cancel itself is written; the hourly refresh catches up
+            print(f"Slot refresh after cancel failed for {form_id}: {e}")
+    return outcomes
+
+
+def _pick_rows(found, phones, status_col):
+    outcomes = {}
+    picked = {}
+    for phone in phones:
+        if phone not in found:
+            outcomes[phone] = "not_found"
+            continue
+        outcomes[phone] = "already_cancelled"
+        for number, cells in found[phone]:
+            status = cells[status_col] if len(cells) > status_col else ""
+            if status.strip().lower() != "cancelled" and number not in picked.values():
+                picked[phone] = number
+                outcomes[phone] = "cancelled"
+                break
+    return outcomes, picked
+
+
+def _rows_still_match(sheets_service, sheet_id, tab, picked, phone_col):
+    # Row numbers come from the mirror; an admin may have deleted or sorted
+    # rows since. One read of the candidate rows confirms each still holds
+    # the phone about to be cancelled.
+    result = execute(sheets_service.spreadsheets().values().batchGet(
         spreadsheetId=sheet_id,
-        range=f"{sheet_title}!A1:Z1000"
-    ).execute()
-    values = result.get("values", [])
-    if not values or len(values) < 2:
-        return "No data found."
-
-    headers = values[0]
-    phone_col = headers.index("Mobile Number") if "Mobile Number" in headers else -1
-    status_col = headers.index("Status") if "Status" in headers else -1
-
-    if phone_col == -1:
-        return "Mobile Number column not found."
-
-    updates = []
-    for i, row in enumerate(values[1:], start=2):
-        if len(row) > phone_col and row[phone_col] == phone:
-            if status_col == -1:
-                # If no Status column, create it
-                sheets_service.spreadsheets().values().update(
-                    spreadsheetId=sheet_id,
-                    range=f"{sheet_title}!{chr(65 + len(headers))}1",
-                    valueInputOption="RAW",
-                    body={"values": [["Status"]]}
-                ).execute()
-                status_col = len(headers)
-            # Update the status cell
-            sheets_service.spreadsheets().values().update(
-                spreadsheetId=sheet_id,
-                range=f"{sheet_title}!{chr(65 + status_col)}{i}",
-                valueInputOption="RAW",
-                body={"values": [["Cancelled"]]}
-            ).execute()
-            return f"Booking for {phone} marked as Cancelled."
+        ranges=[f"{tab}!{number}:{number}" for number in picked.values()]
+    ))
+    for phone, value_range in zip(picked, result.get("valueRanges", [])):
+        cells = (value_range.get("values") or [[]])[0]
+        current = cells[phone_col] if len(cells) > phone_col else ""
+        if sheet_mirror.normalize_phone(current) != sheet_mirror.normalize_phone(phone):
+            return False
+    return True
+
+
+def _cancel_bookings_in_sheet(creds, sheet_id, phones):
+    # Phone -> row comes from the mirror index, checked against the sheet
+    # before anything is written
+    state, found = sheet_mirror.lookup_phones(creds, sheet_id, phones)
+    headers = state["headers"]
+    if not headers or state["row_count"] < 2:
+        raise ValueError("No data found.")
+    if sheet_mirror.PHONE_HEADER not in headers:
+        raise ValueError("Mobile Number column not found.")
+
+    status_col = headers.index("Status") if "Status" in headers else len(headers)
+    phone_col = headers.index(sheet_mirror.PHONE_HEADER)
+    tab = sheet_mirror.quote_tab(state["tab_title"])
+    column = sheet_mirror.column_letter(status_col)
+    sheets_service = get_service(creds, "sheets", "v4")
+
+    outcomes, picked = _pick_rows(found, phones, status_col)
+    if picked and not _rows_still_match(sheets_service, sheet_id, tab, picked, phone_col):
+        # Rows moved under the mirror: rebuild it and pick again from a
+        # sheet read just now
+        state = sheet_mirror.sync_sheet(creds, sheet_id, full=True)
+        if state["headers"] != headers:
+            raise ValueError("The sheet changed while cancelling. Please try again.")
+        outcomes, picked = _pick_rows(sheet_mirror.find_rows(sheet_id, phones), phones, status_col)
+
+    if not picked:
+        return outcomes
+
+    data = [{"range": f"{tab}!{column}{number}", "values": [["Cancelled"]]} for number in picked.values()]
+    if status_col == len(headers):
+        # If no Status column, create it in the same write
+        data.append({"range": f"{tab}!{column}1", "values": [["Status"]]})
+
+    execute(sheets_service.spreadsheets().values().batchUpdate(
+        spreadsheetId=sheet_id,
+        body={"valueInputOption": "RAW", "data": data}
+    ))
+
+    if status_col == len(headers):
+        sheet_mirror.set_headers(sheet_id, headers + ["Status"])
+    for number in picked.values():
+        sheet_mirror.set_cell(sheet_id, number, status_col, "Cancelled")
+    return outcomes
+
+
+def cancel_booking_by_phone(creds, form_id, phone):
+    try:
+        outcome = cancel_bookings(creds, form_id, [phone])[phone]
+    except ValueError as e:
+        return str(e)
+    if outcome == "cancelled":
+        return f"Booking for {phone} marked as Cancelled."
+    if outcome == "already_cancelled":
+        return f"Booking for {phone} is already cancelled."
     return "Booking not found."
+
+
+def cancel_bookings_across_forms(creds, form_ids, phones):
+    report = {phone: [] for phone in phones}
+    for form_id in form_ids:
+        entry = get_form_metadata(form_id) or {}
+        class_name = entry.get("class_name", form_id)
+        try:
+            outcomes = cancel_bookings(creds, form_id, phones)
+        except Exception as e:
+            for phone in phones:
+                report[phone].append({"form_id": form_id, "class_name": class_name, "outcome": "error", "detail": str(e)})
+            continue
+        for phone, outcome in outcomes.items():
+            if outcome != "not_found":
+                report[phone].append({"form_id": form_id, "class_name": class_name, "outcome": outcome})
+    return report
+
+
+def _resolve_sheet_ids(creds, form_ids):
+    # Sheet ids come from local metadata; only forms that never had their
+    # sheet recorded are looked up, together, in one Forms batch. Returns
+    # the sheet ids and the lookups that failed, so a form whose sheet is
+    # unknown isn't mistaken for one without a sheet.
+    sheet_ids = {}
+    errors = {}
+    missing = []
+    conn = metadata_store.connect()
+    for form_id in form_ids:
+        entry = get_form_metadata(form_id) or {}
+        cached = conn.execute(
+            "SELECT linked_sheet_id FROM form_resolution WHERE form_id = ?", (form_id,)
+        ).fetchone()
+        if entry.get("sheet_url"):
+            sheet_ids[form_id] = sheet_id_from_url(entry["sheet_url"])
+        elif cached:
+            sheet_ids[form_id] = cached["linked_sheet_id"]
+        else:
+            missing.append(form_id)
+    if not missing:
+        return sheet_ids, errors
+
+    def on_form(request_id, response, exception):
+        if exception is None:
+            if response.get("linkedSheetId"):
+                sheet_ids[request_id] = response["linkedSheetId"]
+        elif not (isinstance(exception, HttpError) and exception.resp.status == 404):
+            # A form that is already gone has no sheet to find either
+            errors[request_id] = exception
+
+    forms_service = get_service(creds, "forms", "v1")
+    for start in range(0, len(missing), BATCH_LIMIT):
+        chunk = missing[start:start + BATCH_LIMIT]
+        batch = forms_service.new_batch_http_request(callback=on_form)
+        for form_id in chunk:
+            batch.add(forms_service.forms().get(formId=form_id, fields="linkedSheetId"), request_id=form_id)
+        execute(batch, api="forms", cost=len(chunk))
+    return sheet_ids, errors
+
+
+def delete_forms(creds, form_ids):
+    sheet_ids, lookup_errors = _resolve_sheet_ids(creds, form_ids)
+    results = {form_id: {"form": None, "sheet": None} for form_id in form_ids}
+    deletions = []
+    for form_id in form_ids:
+        if form_id in lookup_errors:
+            # Deleting the form now would orphan its sheet: leave both
+            error = f"error: linked Sheet lookup failed: {lookup_errors[form_id]}"
+            results[form_id] = {"form": "not deleted", "sheet": error}
+            continue
+        deletions.append((f"form:{form_id}", form_id))
+        if form_id in sheet_ids:
+            deletions.append((f"sheet:{form_id}", sheet_ids[form_id]))
+        else:
+            results[form_id]["sheet"] = "No linked Sheet found."
+
+    def on_delete(request_id, response, exception):
+        kind, form_id = request_id.split(":", 1)
+        if exception is None:
+            results[form_id][kind] = "deleted"
+        elif isinstance(exception, HttpError) and exception.resp.status == 404:
+            results[form_id][kind] = "already gone"
+        else:
+            results[form_id][kind] = f"error: {exception}"
+
+    drive_service = get_service(creds, "drive", "v3")
+    for start in range(0, len(deletions), BATCH_LIMIT):
+        chunk = deletions[start:start + BATCH_LIMIT]
+        batch = drive_service.new_batch_http_request(callback=on_delete)
+        for request_id, file_id in chunk:
+            batch.add(drive_service.files().delete(fileId=file_id), request_id=request_id)
+        execute(batch, api="drive", cost=len(chunk))
+
+    for form_id, result in results.items():
+        if result["form"] in ("deleted", "already gone"):
+            delete_form_metadata(form_id)
+            invalidate_linked_sheet(form_id)
+            if form_id in sheet_ids:
+                sheet_mirror.drop_sheet(sheet_ids[form_id])
+    return results
+
+
 def update_sheet_url_in_metadata(form_id, sheet_url):
-    data = load_form_metadata()
-    for entry in data:
-        if entry["form_id"] == form_id:
-            entry["sheet_url"] = sheet_url
-            break
-    with open(METADATA_FILE, "w") as f:
-        json.dump(data, f, indent=2)
-from googleapiclient.discovery import build
+    metadata_store.update_form(form_id, sheet_url=sheet_url)
 
 def get_linked_sheet_url(creds, form_id):
-    drive_service = build("drive", "v3", credentials=creds)
+    drive_service = get_service(creds, "drive", "v3")
 
     # Search for the spreadsheet whose parents include this Form
-    response = drive_service.files().list(
+    response = execute(drive_service.files().list(
         q=f"'{form_id}' in parents and mimeType='application/vnd.google-apps.spreadsheet'",
         fields="files(id, name)"
-    ).execute()
+    ))
     files = response.get("files", [])
 
     if not files:
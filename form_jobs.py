@@ -0,0 +1,34 @@
+import booking_counts
+from form_builder import (
+    create_form_and_link_sheet,
+    wait_for_linked_sheet,
+    update_sheet_url_in_metadata,
+    sheet_url_for,
+    inject_form_script,
+    delete_forms
+)
+
+
+# Job bodies for jobs.submit: each takes the progress callback first and
+# returns a JSON-serialisable result.
+
+def create_form_job(report, creds, form_info):
+    report("Copying master form")
+    form_url, edit_url, form_id = create_form_and_link_sheet(creds, form_info)
+    report("Waiting for linked sheet")
+    sheet_id = wait_for_linked_sheet(creds, form_id)
+    if sheet_id:
+        update_sheet_url_in_metadata(form_id, sheet_url_for(sheet_id))
+    return {"form_id": form_id, "form_url": form_url, "sheet_id": sheet_id}
+
+
+def inject_script_job(report, creds, form_id):
+    report("Injecting script")
+    script_id = inject_form_script(creds, form_id)
+    booking_counts.invalidate(form_id)
+    return {"script_id": script_id}
+
+
+def delete_forms_job(report, creds, form_ids):
+    report(f"Deleting {len(form_ids)} form(s)")
+    return delete_forms(creds, form_ids)
@@ -0,0 +1,264 @@
+import hashlib
+import os
+import random
+import threading
+import time
+
+import google_auth_httplib2
+import httplib2
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+import metrics
+
+
+HTTP_TIMEOUT = 60
+GOOGLE_MAX_RETRIES = int(os.environ.get("GOOGLE_MAX_RETRIES", "5"))
+GOOGLE_BACKOFF_CAP_SECONDS = float(os.environ.get("GOOGLE_BACKOFF_CAP_SECONDS", "32"))
+
+# Requests per second and burst per API, kept under the per-user quotas
+# (Sheets allows 60 reads a minute per user). Override with e.g.
+# GOOGLE_RATE_SHEETS="2,30".
+API_RATES = {
+    "sheets": (1.0, 20),
+    "forms": (5.0, 20),
+    "drive": (10.0, 50),
+    "script": (1.0, 10),
+}
+DEFAULT_RATE = (5.0, 20)
+
+# Each thread keeps its own transports and clients: httplib2 connections are
+# not thread-safe, but they are kept alive between calls on the same thread.
+_local = threading.local()
+
+_stats_lock = threading.Lock()
+_stats = {}
+# Set by set_service_factory to serve every API from e.g. fake_google
+_service_factory = None
+
+
+def credential_key(creds):
+    identity = f"{creds.client_id}:{creds.refresh_token}"
+    return hashlib.sha256(identity.encode()).hexdigest()[:16]
+
+
+def _registry():
+    if not hasattr(_local, "clients"):
+        _local.clients = {}
+        _local.transports = {}
+        _local.label = "-"
+        _local.received = 0
+    return _local
+
+
+def set_stats_label(label):
+    _registry().label = label or "-"
+
+
+def _record(api, version, outcome):
+    label = _registry().label
+    key = (label, f"{api}/{version}")
+    with _stats_lock:
+        counts = _stats.setdefault(key, {"built": 0, "reused": 0})
+        counts[outcome] += 1
+
+
+def _evict(registry, cred_key):
+    registry.transports.pop(cred_key, None)
+    for key in [k for k in registry.clients if k[0] == cred_key]:
+        del registry.clients[key]
+
+
+class _MeteredHttp(google_auth_httplib2.AuthorizedHttp):
+    # Tallies response bytes for the call execute() is timing on this thread
+    def request(self, *args, **kwargs):
+        resp, content = super().request(*args, **kwargs)
+        _local.received += len(content or b"")
+        return resp, content
+
+
+def _transport(registry, cred_key, creds):
+    authed_http = registry.transports.get(cred_key)
+    if authed_http is None:
+        authed_http = _MeteredHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        registry.transports[cred_key] = authed_http
+    elif authed_http.credentials is not creds:
+        # Same account carried by a fresh Credentials object (e.g. rebuilt
+        # from the session): keep the pooled connection, swap the creds.
+        authed_http.credentials = creds
+    return authed_http
+
+
+def set_service_factory(factory):
+    # factory(api, version) -> service; None restores the real clients
+    global _service_factory
+    _service_factory = factory
+
+
+def get_service(creds, api, version):
+    if _service_factory is not None:
+        return _service_factory(api, version)
+    registry = _registry()
+    cred_key = credential_key(creds)
+    key = (cred_key, api, version)
+
+    entry = registry.clients.get(key)
+    if entry and entry[0] != creds.token:
+        # Token was refreshed or replaced: drop every client bound to the old one
+        _evict(registry, cred_key)
+        entry = None
+
+    transport = _transport(registry, cred_key, creds)
+    if entry:
+        _record(api, version, "reused")
+        return entry[1]
+
+    service = build(
+        api,
+        version,
+        http=transport,
+        static_discovery=True,
+        cache_discovery=False
+    )
+    registry.clients[key] = (creds.token, service)
+    _record(api, version, "built")
+    return service
+
+
+def client_stats():
+    with _stats_lock:
+        snapshot = {}
+        for (label, api), counts in _stats.items():
+            snapshot.setdefault(label, {})[api] = dict(counts)
+    return snapshot
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, cost=1):
+        # Returns how long the caller has to sleep before its call may go out
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= cost
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_call_stats = {}
+
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = (b"rateLimitExceeded", b"userRateLimitExceeded")
+
+
+def _bucket(api):
+    with _buckets_lock:
+        bucket = _buckets.get(api)
+        if bucket is None:
+            rate, burst = API_RATES.get(api, DEFAULT_RATE)
+            override = os.environ.get(f"GOOGLE_RATE_{api.upper()}")
+            if override:
+                rate, burst = (float(part) for part in override.split(","))
+            bucket = _buckets[api] = TokenBucket(rate, burst)
+        return bucket
+
+
+def _count(api, **deltas):
+    with _stats_lock:
+        counts = _call_stats.setdefault(api, {
+            "calls": 0, "retries": 0, "errors": 0, "throttle_waits": 0, "throttle_seconds": 0.0
+        })
+        for name, delta in deltas.items():
+            counts[name] += delta
+
+
+def api_name(request):
+    # methodId looks like "sheets.spreadsheets.values.batchGet"
+    method_id = getattr(request, "methodId", None) or ""
+    return method_id.split(".", 1)[0] or "other"
+
+
+def method_name(request):
+    method_id = getattr(request, "methodId", None)
+    return method_id.split(".", 1)[-1] if method_id else "batch"
+
+
+def acquire(api, cost=1):
+    wait = _bucket(api).take(cost)
+    if wait:
+        _count(api, throttle_waits=1, throttle_seconds=wait)
+        time.sleep(wait)
+
+
+def is_rate_limited(error):
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status == 429:
+        return True
+    return error.resp.status == 403 and any(reason in (error.content or b"") for reason in RATE_LIMIT_REASONS)
+
+
+def is_transient(error):
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUSES or is_rate_limited(error)
+    return isinstance(error, (ConnectionError, TimeoutError, OSError, httplib2.HttpLib2Error))
+
+
+def backoff_delay(attempt, error=None):
+    retry_after = error.resp.get("retry-after") if isinstance(error, HttpError) else None
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    # Full jitter keeps workers that failed together from retrying together
+    return random.uniform(0, min(GOOGLE_BACKOFF_CAP_SECONDS, 2 ** attempt))
+
+
+def execute(request, api=None, cost=1):
+    # Single entry point for Google calls: rate limit, run, retry on
+    # transient failures. Batches pass api and cost (number of calls) since
+    # they have no methodId. POSTs that may have run (5xx, dropped
+    # connection) are not repeated; only rate-limit rejections are.
+    api = api or api_name(request)
+    labels = (("api", api), ("method", method_name(request)))
+    idempotent = getattr(request, "method", "POST") in ("GET", "PUT", "DELETE")
+    body = getattr(request, "body", None)
+    if body:
+        metrics.observe("google_api_request_size_bytes", labels, len(body))
+    registry = _registry()
+    attempt = 0
+    while True:
+        acquire(api, cost)
+        _count(api, calls=1)
+        registry.received = 0
+        started = time.perf_counter()
+        try:
+            result = request.execute()
+        except Exception as e:
+            metrics.observe("google_api_call_duration_seconds", labels, time.perf_counter() - started)
+            status = str(e.resp.status) if isinstance(e, HttpError) else type(e).__name__
+            metrics.inc("google_api_call_errors_total", labels + (("status", status),))
+            retryable = is_rate_limited(e) or (idempotent and is_transient(e))
+            if attempt >= GOOGLE_MAX_RETRIES or not retryable:
+                _count(api, errors=1)
+                raise
+            attempt += 1
+            _count(api, retries=1)
+            time.sleep(backoff_delay(attempt, e))
+            continue
+        metrics.observe("google_api_call_duration_seconds", labels, time.perf_counter() - started)
+        metrics.observe("google_api_response_size_bytes", labels, registry.received)
+        return result
+
+
+def api_call_stats():
+    with _stats_lock:
+        return {api: dict(counts) for api, counts in _call_stats.items()}
@@ -0,0 +1,122 @@
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metadata_store
+
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+# A job still queued or running after this long lost its worker (restart,
+# crash) and is shown as failed instead of in progress forever
+JOB_TIMEOUT_SECONDS = float(os.environ.get("JOB_TIMEOUT_SECONDS", "3600"))
+
+metadata_store.register_schema("""
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    form_id TEXT,
+    status TEXT NOT NULL,
+    progress TEXT,
+    error TEXT,
+    result TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at);
+""")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    # Created lazily so each gunicorn worker gets its own pool after fork
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+        return _executor
+
+
+def _update(job_id, **fields):
+    columns = ", ".join(f"{name} = ?" for name in fields)
+    with metadata_store.transaction() as conn:
+        conn.execute(f"UPDATE jobs SET {columns} WHERE job_id = ?", (*fields.values(), job_id))
+
+
+def _run(job_id, fn, args, kwargs):
+    _update(job_id, status="running", started_at=time.time())
+
+    def report(message):
+        _update(job_id, progress=message)
+
+    try:
+        result = fn(report, *args, **kwargs)
+    except Exception as e:
+        traceback.print_exc()
+        _update(job_id, status="failed", error=str(e) or type(e).__name__, finished_at=time.time())
+        return
+    _update(job_id, status="done", result=json.dumps(result), finished_at=time.time())
+
+
+def submit(kind, fn, *args, form_id=None, **kwargs):
+    job_id = uuid.uuid4().hex
+    with metadata_store.transaction() as conn:
+        conn.execute(
+            "INSERT INTO jobs (job_id, kind, form_id, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+            (job_id, kind, form_id, time.time())
+        )
+    _get_executor().submit(_run, job_id, fn, args, kwargs)
+    return job_id
+
+
+def _fail_stale():
+    cutoff = time.time() - JOB_TIMEOUT_SECONDS
+    stale = "status IN ('queued', 'running') AND COALESCE(started_at, created_at) < ?"
+    # Checked read-only first so polling a job doesn't take the write lock
+    if metadata_store.connect().execute(f"SELECT 1 FROM jobs WHERE {stale} LIMIT 1", (cutoff,)).fetchone() is None:
+        return
+    with metadata_store.transaction() as conn:
+        conn.execute(
+            f"UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE {stale}",
+            ("Interrupted: the worker running this job stopped.", time.time(), cutoff)
+        )
+
+
+def _as_dict(row):
+    job = dict(row)
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    end = job["finished_at"] or time.time()
+    job["queued_seconds"] = round((job["started_at"] or end) - job["created_at"], 3)
+    job["run_seconds"] = round(end - job["started_at"], 3) if job["started_at"] else None
+    return job
+
+
+def get_job(job_id):
+    _fail_stale()
+    row = metadata_store.connect().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    return _as_dict(row) if row else None
+
+
+def recent_jobs(limit=10):
+    _fail_stale()
+    rows = metadata_store.connect().execute(
+        "SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+    ).fetchall()
+    return [_as_dict(row) for row in rows]
+
+
+def wait(job_id, timeout=None, interval=0.05):
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        job = get_job(job_id)
+        if job is None or job["status"] in ("done", "failed"):
+            return job
+        if deadline is not None and time.time() > deadline:
+            return job
+        time.sleep(interval)
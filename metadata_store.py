@@ -0,0 +1,132 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+DB_FILE = os.environ.get("BOOKING_DB", "booking.db")
+LEGACY_JSON_FILE = "forms.json"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS forms (
+    form_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Other modules add their own tables to the same database via register_schema
+_schemas = [_SCHEMA]
+
+# One connection per thread; sqlite3 connections must not be shared.
+_local = threading.local()
+
+
+def register_schema(sql):
+    _schemas.append(sql)
+
+
+def connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_FILE, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+        _local.applied = 0
+        _local.forms_cache = None
+    if _local.applied < len(_schemas):
+        for sql in _schemas[_local.applied:]:
+            conn.executescript(sql)
+        if _local.applied == 0:
+            _import_legacy_json(conn)
+        _local.applied = len(_schemas)
+    return conn
+
+
+@contextmanager
+def transaction():
+    conn = connect()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    _local.forms_cache = None
+
+
+def _import_legacy_json(conn):
+    # forms.json is imported exactly once, whichever worker gets here first
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        done = conn.execute("SELECT value FROM store_meta WHERE key = 'legacy_imported'").fetchone()
+        if not done and os.path.exists(LEGACY_JSON_FILE):
+            with open(LEGACY_JSON_FILE, "r") as f:
+                entries = json.load(f)
+            for position, entry in enumerate(entries):
+                conn.execute(
+                    "INSERT OR IGNORE INTO forms (form_id, position, data) VALUES (?, ?, ?)",
+                    (entry["form_id"], position, json.dumps(entry))
+                )
+        conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES ('legacy_imported', '1')")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def list_forms():
+    conn = connect()
+    # data_version only moves when another connection commits; our own
+    # commits clear the cache in transaction().
+    version = conn.execute("PRAGMA data_version").fetchone()[0]
+    cache = _local.forms_cache
+    if cache and cache[0] == version:
+        return cache[1]
+    rows = conn.execute("SELECT data FROM forms ORDER BY position").fetchall()
+    forms = [json.loads(row["data"]) for row in rows]
+    # The cached list is shared between calls: callers must not mutate it
+    _local.forms_cache = (version, forms)
+    return forms
+
+
+def get_form(form_id):
+    row = connect().execute("SELECT data FROM forms WHERE form_id = ?", (form_id,)).fetchone()
+    return json.loads(row["data"]) if row else None
+
+
+def add_form(entry):
+    with transaction() as conn:
+        position = conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM forms").fetchone()[0]
+        conn.execute(
+            "INSERT OR REPLACE INTO forms (form_id, position, data) VALUES (?, ?, ?)",
+            (entry["form_id"], position, json.dumps(entry))
+        )
+
+
+def update_form(form_id, **fields):
+    with transaction() as conn:
+        row = conn.execute("SELECT data FROM forms WHERE form_id = ?", (form_id,)).fetchone()
+        if not row:
+            return None
+        entry = json.loads(row["data"])
+        entry.update(fields)
+        conn.execute("UPDATE forms SET data = ? WHERE form_id = ?", (json.dumps(entry), form_id))
+    return entry
+
+
+def delete_form(form_id):
+    with transaction() as conn:
+        deleted = conn.execute("DELETE FROM forms WHERE form_id = ?", (form_id,)).rowcount
+    return deleted > 0
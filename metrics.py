@@ -0,0 +1,89 @@
+import bisect
+import threading
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_lock = threading.Lock()
+# name -> {"type", "help", "buckets", "series": {labels: value or [counts, sum, count]}}
+_metrics = {}
+
+
+def _register(kind, name, help_text, buckets=None):
+    _metrics[name] = {"type": kind, "help": help_text, "buckets": buckets, "series": {}}
+
+
+def counter(name, help_text):
+    _register("counter", name, help_text)
+
+
+def histogram(name, help_text, buckets=LATENCY_BUCKETS):
+    _register("histogram", name, help_text, buckets)
+
+
+def inc(name, labels, amount=1):
+    # labels is a tuple of (key, value) pairs so it can key the series dict
+    series = _metrics[name]["series"]
+    with _lock:
+        series[labels] = series.get(labels, 0) + amount
+
+
+def observe(name, labels, value):
+    metric = _metrics[name]
+    index = bisect.bisect_left(metric["buckets"], value)
+    with _lock:
+        data = metric["series"].get(labels)
+        if data is None:
+            data = metric["series"][labels] = [[0] * len(metric["buckets"]), 0.0, 0]
+        if index < len(data[0]):
+            data[0][index] += 1
+        data[1] += value
+        data[2] += 1
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    lines = []
+    with _lock:
+        for name, metric in sorted(_metrics.items()):
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for labels, data in sorted(metric["series"].items()):
+                if metric["type"] == "counter":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_number(data)}")
+                    continue
+                counts, total, count = data
+                cumulative = 0
+                for bound, bucket_count in zip(metric["buckets"], counts):
+                    cumulative += bucket_count
+                    le = (("le", _format_number(float(bound))),)
+                    lines.append(f"{name}_bucket{_format_labels(labels, le)} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+histogram("http_request_duration_seconds", "Flask request latency by route.")
+histogram("http_response_size_bytes", "Flask response body size by route.", SIZE_BUCKETS)
+counter("http_requests_total", "Flask requests by route, method and status.")
+counter("http_request_exceptions_total", "Flask requests that raised an unhandled exception.")
+histogram("google_api_call_duration_seconds", "Google API call latency per attempt.")
+histogram("google_api_request_size_bytes", "Google API request body size.", SIZE_BUCKETS)
+histogram("google_api_response_size_bytes", "Google API response body size.", SIZE_BUCKETS)
+counter("google_api_call_errors_total", "Failed Google API call attempts by HTTP status.")
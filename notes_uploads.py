@@ -0,0 +1,105 @@
+import hashlib
+import os
+import time
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
+
+import metadata_store
+from google_clients import get_service, execute, acquire, is_transient, backoff_delay
+
+
+HASH_CHUNK_BYTES = 1024 * 1024
+# Resumable chunks must be a multiple of 256 KiB
+UPLOAD_CHUNK_BYTES = int(os.environ.get("UPLOAD_CHUNK_BYTES", str(4 * 256 * 1024)))
+UPLOAD_RETRIES = 5
+
+metadata_store.register_schema("""
+CREATE TABLE IF NOT EXISTS drive_uploads (
+    content_hash TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    uploaded_at REAL NOT NULL
+);
+""")
+
+
+def stream_sha256(stream):
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_BYTES), b""):
+        digest.update(chunk)
+        size += len(chunk)
+    stream.seek(0)
+    return digest.hexdigest(), size
+
+
+def drive_download_url(file_id):
+    return f"https://drive.google.com/uc?id={file_id}&export=download"
+
+
+def find_upload(content_hash):
+    row = metadata_store.connect().execute(
+        "SELECT * FROM drive_uploads WHERE content_hash = ?", (content_hash,)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def record_upload(content_hash, file_id, name, size):
+    url = drive_download_url(file_id)
+    with metadata_store.transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO drive_uploads (content_hash, file_id, url, name, size, uploaded_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (content_hash, file_id, url, name, size, time.time())
+        )
+    return url
+
+
+def is_still_shared(drive_service, file_id):
+    # Someone may have deleted or trashed the file in Drive since we indexed it
+    try:
+        file = execute(drive_service.files().get(fileId=file_id, fields="id,trashed"))
+    except HttpError as e:
+        if e.resp.status == 404:
+            return False
+        raise
+    return not file.get("trashed")
+
+
+def _run_resumable(request):
+    # next_chunk picks up from the last byte Drive acknowledged, so a dropped
+    # connection resumes the session instead of restarting the file.
+    response = None
+    failures = 0
+    while response is None:
+        acquire("drive")
+        try:
+            _, response = request.next_chunk()
+            failures = 0
+        except Exception as e:
+            failures += 1
+            if failures > UPLOAD_RETRIES or not is_transient(e):
+                raise
+            time.sleep(backoff_delay(failures, e))
+    return response
+
+
+def upload_pdf_to_drive(creds, stream, filename):
+    # stream is the werkzeug upload stream; it is hashed and then handed to
+    # Drive chunk by chunk without being saved under uploads/ first.
+    drive_service = get_service(creds, "drive", "v3")
+    content_hash, size = stream_sha256(stream)
+
+    existing = find_upload(content_hash)
+    if existing and is_still_shared(drive_service, existing["file_id"]):
+        return existing["url"]
+
+    file_metadata = {"name": filename, "mimeType": "application/pdf"}
+    media = MediaIoBaseUpload(stream, mimetype="application/pdf", chunksize=UPLOAD_CHUNK_BYTES, resumable=True)
+    request = drive_service.files().create(body=file_metadata, media_body=media, fields="id")
+    file = _run_resumable(request)
+    execute(drive_service.permissions().create(fileId=file["id"], body={"type": "anyone", "role": "reader"}))
+    return record_upload(content_hash, file["id"], filename, size)
@@ -0,0 +1,280 @@
+import json
+import os
+import random
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import booking_engine
+import credential_manager
+import metadata_store
+import metrics
+import sheet_mirror
+from form_builder import SCRIPT_HASH, sheet_id_from_url
+from notify_gateway import NOTIFY_FROM_SCRIPT, GatewayError, get_gateway, message_params
+from submissions import SLOT_HEADER, STATUS_HEADER, normalize_slot, normalize_status
+
+
+NOTIFY_WORKERS = int(os.environ.get("NOTIFY_WORKERS", "16"))
+NOTIFY_POLL_SECONDS = float(os.environ.get("NOTIFY_POLL_SECONDS", "15"))
+NOTIFY_BATCH = int(os.environ.get("NOTIFY_BATCH", "500"))
+NOTIFY_MAX_ATTEMPTS = int(os.environ.get("NOTIFY_MAX_ATTEMPTS", "6"))
+NOTIFY_BACKOFF_CAP_SECONDS = float(os.environ.get("NOTIFY_BACKOFF_CAP_SECONDS", "600"))
+# Slots that expired longer ago than this are never picked up, so turning
+# the outbox on doesn't message every class that ever ran.
+NOTIFY_EXPIRY_WINDOW_SECONDS = float(os.environ.get("NOTIFY_EXPIRY_WINDOW_SECONDS", "43200"))
+# A claim older than this is assumed to belong to a worker that died
+NOTIFY_CLAIM_SECONDS = 300
+NOTIFIED_HEADER = "ExpiryNotified"
+
+metadata_store.register_schema("""
+CREATE TABLE IF NOT EXISTS notifications (
+    notification_id TEXT PRIMARY KEY,
+    form_id TEXT NOT NULL,
+    slot TEXT NOT NULL,
+    due_at REAL NOT NULL,
+    phone TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    claim TEXT,
+    claimed_at REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS notifications_dedupe ON notifications (form_id, slot, due_at, phone, kind);
+CREATE INDEX IF NOT EXISTS notifications_due ON notifications (status, next_attempt_at);
+CREATE TABLE IF NOT EXISTS notification_scans (
+    form_id TEXT NOT NULL,
+    slot TEXT NOT NULL,
+    due_at REAL NOT NULL,
+    revision INTEGER NOT NULL,
+    pending INTEGER NOT NULL,
+    PRIMARY KEY (form_id, slot, due_at)
+);
+""")
+
+metrics.counter("notifications_total", "Notification send attempts by kind and result.")
+
+_worker = None
+_worker_lock = threading.Lock()
+_wake = threading.Event()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _sends_from_app(form):
+    # A sheet with a script keeps sending until its current script was pushed
+    # a config handing the messages over; flipping NOTIFY_FROM_SCRIPT only
+    # moves a form once its config is pushed again.
+    if not form.get("script_id"):
+        return not NOTIFY_FROM_SCRIPT
+    return form.get("script_hash") == SCRIPT_HASH and form.get("notify_from_script") is False
+
+
+def enqueue(form_id, slot, due_at, phones, kind, params):
+    # Dedupe is the unique index: a phone gets one message per slot session,
+    # however many times the same booking is seen.
+    now = time.time()
+    payload = json.dumps(params)
+    with metadata_store.transaction() as conn:
+        before = conn.total_changes
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO notifications
+                (notification_id, form_id, slot, due_at, phone, kind, params, status, next_attempt_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 'pending', ?, ?)
+            """,
+            [(uuid.uuid4().hex, form_id, slot, due_at, phone, kind, payload, now, now) for phone in set(phones)]
+        )
+        added = conn.total_changes - before
+    if added:
+        _wake.set()
+    return added
+
+
+def _cell(cells, col):
+    return cells[col] if 0 <= col < len(cells) else ""
+
+
+def _sheet_recipients(state, sheet_id, due):
+    headers = state["headers"]
+    if sheet_mirror.PHONE_HEADER not in headers or SLOT_HEADER not in headers:
+        return {}
+    phone_col = headers.index(sheet_mirror.PHONE_HEADER)
+    slot_col = headers.index(SLOT_HEADER)
+    status_col = headers.index(STATUS_HEADER) if STATUS_HEADER in headers else -1
+    notified_col = headers.index(NOTIFIED_HEADER) if NOTIFIED_HEADER in headers else -1
+
+    recipients = {slot: [] for slot in due}
+    for _, cells in sheet_mirror.iter_rows(sheet_id):
+        slot = normalize_slot(_cell(cells, slot_col))
+        phone = sheet_mirror.normalize_phone(_cell(cells, phone_col))
+        if slot not in recipients or not phone:
+            continue
+        if normalize_status(_cell(cells, status_col)) in ("cancelled", "duplicate"):
+            continue
+        # Already messaged by the sheet's own trigger
+        if str(_cell(cells, notified_col)).strip() == "YES":
+            continue
+        recipients[slot].append(phone)
+    return recipients
+
+
+def enqueue_expired(creds, form, now=None):
+    now = time.time() if now is None else now
+    if not _sends_from_app(form) or not form.get("sheet_url"):
+        return 0
+    due = {}
+    for slot in form.get("slots", []):
+        expiry = booking_engine._expiry(slot)
+        if expiry is not None and expiry <= now < expiry + NOTIFY_EXPIRY_WINDOW_SECONDS:
+            due[slot["name"]] = expiry
+    if not due:
+        return 0
+
+    sheet_id = sheet_id_from_url(form["sheet_url"])
+    rows = metadata_store.connect().execute(
+        "SELECT slot, due_at, revision, pending FROM notification_scans WHERE form_id = ?", (form["form_id"],)
+    ).fetchall()
+    scanned = {row["slot"]: (row["revision"], row["pending"]) for row in rows if due.get(row["slot"]) == row["due_at"]}
+    pending = {slot: [] for slot in due}
+    for booking in booking_engine.unappended_bookings(form["form_id"]):
+        # Not in the sheet yet; once appended they're read from the mirror
+        if booking["slot"] in pending:
+            pending[booking["slot"]].append(booking["phone"])
+
+    # Once a slot's phones are all in the outbox the sheet only needs reading
+    # again while reserved bookings are still on their way into it
+    state = None
+    if all(slot in scanned and not pending[slot] for slot in due):
+        state = sheet_mirror.get_state(sheet_id)
+    if state is None:
+        state = sheet_mirror.ensure_fresh(creds, sheet_id)
+    # Rescan only when the mirror or the local bookings moved since last time
+    due = {
+        slot: expiry for slot, expiry in due.items()
+        if scanned.get(slot) != (state["revision"], len(pending[slot]))
+    }
+    if not due:
+        return 0
+
+    recipients = _sheet_recipients(state, sheet_id, due)
+    params = message_params(form.get("meet_link", ""), form.get("notes", ""))
+    added = 0
+    for slot, expiry in due.items():
+        phones = recipients.get(slot, []) + pending[slot]
+        added += enqueue(form["form_id"], slot, expiry, phones, "expiry", params)
+        with metadata_store.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO notification_scans (form_id, slot, due_at, revision, pending) VALUES (?, ?, ?, ?, ?)",
+                (form["form_id"], slot, expiry, state["revision"], len(pending[slot]))
+            )
+    return added
+
+
+def _claim_due():
+    claim = uuid.uuid4().hex
+    now = time.time()
+    with metadata_store.transaction() as conn:
+        conn.execute(
+            """
+            UPDATE notifications SET status = 'sending', claim = ?, claimed_at = ? WHERE notification_id IN (
+                SELECT notification_id FROM notifications
+                WHERE (status = 'pending' AND next_attempt_at <= ?) OR (status = 'sending' AND claimed_at < ?)
+                ORDER BY next_attempt_at LIMIT ?
+            )
+            """,
+            (claim, now, now, now - NOTIFY_CLAIM_SECONDS, NOTIFY_BATCH)
+        )
+        return conn.execute("SELECT * FROM notifications WHERE claim = ?", (claim,)).fetchall()
+
+
+def retry_delay(attempts):
+    # Full jitter so a gateway outage isn't followed by every retry at once
+    return random.uniform(0, min(NOTIFY_BACKOFF_CAP_SECONDS, 5 * 2 ** attempts))
+
+
+def _deliver(notification):
+    attempts = notification["attempts"] + 1
+    try:
+        get_gateway().send(notification["phone"], json.loads(notification["params"]))
+    except GatewayError as e:
+        failed = attempts >= NOTIFY_MAX_ATTEMPTS
+        with metadata_store.transaction() as conn:
+            conn.execute(
+                """
+                UPDATE notifications SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, claim = NULL
+                WHERE notification_id = ?
+                """,
+                ("failed" if failed else "pending", attempts, time.time() + retry_delay(attempts), str(e)[:500],
+                 notification["notification_id"])
+            )
+        metrics.inc("notifications_total", (("kind", notification["kind"]), ("result", "failed" if failed else "retry")))
+        return False
+    with metadata_store.transaction() as conn:
+        conn.execute(
+            "UPDATE notifications SET status = 'sent', attempts = ?, sent_at = ?, claim = NULL WHERE notification_id = ?",
+            (attempts, time.time(), notification["notification_id"])
+        )
+    metrics.inc("notifications_total", (("kind", notification["kind"]), ("result", "sent")))
+    return True
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=NOTIFY_WORKERS, thread_name_prefix="notify")
+        return _pool
+
+
+def dispatch_due():
+    # The gateway is one HTTP round trip per message, so a class goes out
+    # NOTIFY_WORKERS at a time instead of one after another.
+    claimed = _claim_due()
+    if claimed:
+        list(_get_pool().map(_deliver, claimed))
+    return len(claimed)
+
+
+def _notify_loop():
+    while True:
+        _wake.wait(NOTIFY_POLL_SECONDS)
+        _wake.clear()
+        info = credential_manager.load_info()
+        if info is not None:
+            creds = credential_manager.get_credentials(info)
+            for form in metadata_store.list_forms():
+                try:
+                    enqueue_expired(creds, form)
+                except Exception:
+                    # One unreadable sheet shouldn't hold up the rest
+                    traceback.print_exc()
+        try:
+            while dispatch_due() >= NOTIFY_BATCH:
+                pass
+        except Exception:
+            # Claimed rows are retried once their claim expires
+            traceback.print_exc()
+
+
+def ensure_worker():
+    # One outbox thread per process; claims keep gunicorn workers apart
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_notify_loop, name="notify-outbox", daemon=True)
+            _worker.start()
+
+
+def outbox_stats():
+    rows = metadata_store.connect().execute(
+        "SELECT status, COUNT(*) AS n FROM notifications GROUP BY status"
+    ).fetchall()
+    return {row["status"]: row["n"] for row in rows}
@@ -0,0 +1,120 @@
+import os
+import random
+import threading
+import time
+
+import requests
+
+
+# WhatsApp gateway used for class notifications. The account has no default:
+# NOTIFY_GATEWAY_USER and NOTIFY_GATEWAY_PASS must be set unless the gateway
+# is the stub.
+GATEWAY = os.environ.get("NOTIFY_GATEWAY", "bhashsms")  # "stub" records instead of sending
+GATEWAY_URL = os.environ.get("NOTIFY_GATEWAY_URL", "https://bhashsms.com/api/sendmsgutil.php")
+GATEWAY_USER = os.environ.get("NOTIFY_GATEWAY_USER", "")
+GATEWAY_PASS = os.environ.get("NOTIFY_GATEWAY_PASS", "")
+GATEWAY_SENDER = os.environ.get("NOTIFY_GATEWAY_SENDER", "BUZWAP")
+GATEWAY_TIMEOUT_SECONDS = float(os.environ.get("NOTIFY_GATEWAY_TIMEOUT_SECONDS", "15"))
+# Expiry messages stay with the sheet's time trigger, which runs whether or
+# not the app is up; set to 0 to hand them to the app outbox instead.
+NOTIFY_FROM_SCRIPT = os.environ.get("NOTIFY_FROM_SCRIPT", "1") == "1"
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+class GatewayError(Exception):
+    pass
+
+
+def message_params(meet_link, notes_url):
+    # Same templates the Apps Script trigger sends
+    if meet_link and notes_url:
+        return {"text": "bookmeet", "htype": "document", "fname": "notes.pdf", "url": notes_url, "Params": meet_link}
+    if meet_link:
+        return {"text": "meet " + meet_link}
+    return {"text": "tex1"}
+
+
+def _require_account():
+    if GATEWAY != "stub" and not (GATEWAY_USER and GATEWAY_PASS):
+        raise GatewayError("NOTIFY_GATEWAY_USER and NOTIFY_GATEWAY_PASS must be set to send notifications")
+
+
+def script_settings():
+    # Merged into the script config; the gateway account is only handed to
+    # the sheet when the sheet is the one sending.
+    if not NOTIFY_FROM_SCRIPT:
+        return {"notifyFromScript": False}
+    _require_account()
+    return {
+        "notifyFromScript": True,
+        "gateway": {"url": GATEWAY_URL, "user": GATEWAY_USER, "pass": GATEWAY_PASS, "sender": GATEWAY_SENDER}
+    }
+
+
+class BhashSmsGateway:
+    def __init__(self, url=GATEWAY_URL, user=GATEWAY_USER, password=GATEWAY_PASS, sender=GATEWAY_SENDER):
+        self.url = url
+        self.user = user
+        self.password = password
+        self.sender = sender
+        self._local = threading.local()
+
+    def _session(self):
+        # Keep-alive per worker thread; Session isn't safe to share
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def send(self, phone, params):
+        query = {
+            "user": self.user,
+            "pass": self.password,
+            "sender": self.sender,
+            "phone": phone,
+            "priority": "wa",
+            "stype": "normal",
+        }
+        query.update(params)
+        try:
+            response = self._session().get(self.url, params=query, timeout=GATEWAY_TIMEOUT_SECONDS)
+        except requests.RequestException as e:
+            raise GatewayError(str(e)) from e
+        if response.status_code >= 400:
+            raise GatewayError(f"HTTP {response.status_code}: {response.text[:200]}")
+
+
+class StubGateway:
+    """Records messages instead of sending them; can be told to be slow or flaky."""
+
+    def __init__(self, latency=0.0, fail_rate=0.0, seed=None):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.sent = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def send(self, phone, params):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if self._random.random() < self.fail_rate:
+                raise GatewayError("stub failure")
+            self.sent.append((phone, dict(params)))
+
+
+def get_gateway():
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _require_account()
+            _gateway = StubGateway() if GATEWAY == "stub" else BhashSmsGateway()
+        return _gateway
+
+
+def set_gateway(gateway):
+    global _gateway
+    with _gateway_lock:
+        _gateway = gateway
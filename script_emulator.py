@@ -0,0 +1,204 @@
+"""Python emulation of the generated Apps Script booking logic.
+
+Replays the same submissions through the original full-scan onFormSubmit /
+refreshSlots and through the incremental script-properties index, and checks
+that Duplicate marks and per-slot counts agree. Every other scenario gets a
+tiny index budget so the switch to column-scan mode is exercised too.
+
+    python script_emulator.py [scenarios] [max_rows]
+"""
+import random
+import re
+import sys
+
+
+SLOT_SUFFIX = re.compile(r"\s*\(.*\)")
+PHONE_KEY = "idx_p_"
+EMAIL_KEY = "idx_e_"
+BOOKING_KEY = "idx_k_"
+COUNT_KEY = "cnt_"
+INDEX_READY = "index_ready"
+INDEX_MAX_BYTES = 400000
+
+
+def slot_name(slot_raw):
+    return SLOT_SUFFIX.sub("", str(slot_raw), count=1).strip()
+
+
+def cell_key(value):
+    # JS: value === undefined ? "\u0000" : String(value)
+    return "\u0000" if value is None else str(value)
+
+
+def booking_key(phone, email, slot):
+    phone = str(phone).strip() if phone else ""
+    email = str(email).strip() if email else ""
+    return f"{phone}_{email}_{slot}".lower()
+
+
+def legacy_on_form_submit(rows):
+    # Original logic: compare the new row with every earlier row
+    new = rows[-1]
+    for row in rows[:-1]:
+        if row["phone"] == new["phone"] or row["email"] == new["email"]:
+            new["status"] = "Duplicate"
+            return
+    return legacy_refresh_slots(rows)
+
+
+def legacy_refresh_slots(rows):
+    counts = {}
+    unique = set()
+    for row in rows:
+        status = row["status"]
+        if not row["slot"] or status in ("Cancelled", "Duplicate"):
+            continue
+        slot = slot_name(row["slot"])
+        key = booking_key(row["phone"], row["email"], slot)
+        if key in unique:
+            continue
+        unique.add(key)
+        counts[slot] = counts.get(slot, 0) + 1
+    return counts
+
+
+def is_booking_key(key):
+    return key.startswith((PHONE_KEY, EMAIL_KEY, BOOKING_KEY))
+
+
+class IncrementalIndex:
+    def __init__(self, slots, max_bytes=INDEX_MAX_BYTES):
+        self.slots = slots
+        self.max_bytes = max_bytes
+        self.props = {}
+        self.scan = False
+
+    def index_bytes(self):
+        return sum(len(k) + len(v) for k, v in self.props.items() if is_booking_key(k))
+
+    def reconcile(self, rows, stop_row=None):
+        end = len(rows) if stop_row is None else min(stop_row, len(rows))
+        index = {}
+        counts = {}
+        for row in rows[:end]:
+            index[PHONE_KEY + cell_key(row["phone"])] = "1"
+            index[EMAIL_KEY + cell_key(row["email"])] = "1"
+            if not row["slot"] or row["status"] in ("Cancelled", "Duplicate"):
+                continue
+            slot = slot_name(row["slot"])
+            key = BOOKING_KEY + booking_key(row["phone"], row["email"], slot)
+            if key in index:
+                continue
+            index[key] = "1"
+            counts[slot] = counts.get(slot, 0) + 1
+        self.scan = sum(len(k) + len(v) for k, v in index.items()) > self.max_bytes
+        if self.scan:
+            index = {}
+        for slot, count in counts.items():
+            index[COUNT_KEY + slot] = str(count)
+        kept = {k: v for k, v in self.props.items() if not k.startswith(("idx_", COUNT_KEY))}
+        kept.update(index)
+        kept[INDEX_READY] = "1"
+        self.props = kept
+        return counts
+
+    def on_form_submit(self, rows):
+        new = rows[-1]
+        if self.props.get(INDEX_READY) != "1":
+            self.reconcile(rows, len(rows) - 1)
+
+        phone_key = PHONE_KEY + cell_key(new["phone"])
+        email_key = EMAIL_KEY + cell_key(new["email"])
+        if self.scan:
+            # Column scan of the earlier rows instead of the index
+            duplicate = any(
+                cell_key(row["phone"]) == cell_key(new["phone"]) or cell_key(row["email"]) == cell_key(new["email"])
+                for row in rows[:-1]
+            )
+        else:
+            duplicate = phone_key in self.props or email_key in self.props
+            self.props[phone_key] = "1"
+            self.props[email_key] = "1"
+        if duplicate:
+            new["status"] = "Duplicate"
+        elif new["slot"]:
+            slot = slot_name(new["slot"])
+            key = BOOKING_KEY + booking_key(new["phone"], new["email"], slot)
+            if self.scan or key not in self.props:
+                if not self.scan:
+                    self.props[key] = "1"
+                self.props[COUNT_KEY + slot] = str(int(self.props.get(COUNT_KEY + slot, "0")) + 1)
+        if not self.scan and self.index_bytes() > self.max_bytes:
+            # Over budget: drop the per-booking keys, keep the counts
+            self.props = {k: v for k, v in self.props.items() if not is_booking_key(k)}
+            self.scan = True
+
+    def counts(self):
+        return {slot: int(self.props[COUNT_KEY + slot]) for slot in self.slots if COUNT_KEY + slot in self.props}
+
+
+def random_submission(rng, slots, with_email=True):
+    phones = [f"98{n:08d}" for n in range(rng.randint(5, 60))]
+    emails = [f"student{n}@example.com" for n in range(rng.randint(5, 60))]
+    slot = rng.choice(slots + [""])
+    if slot and rng.random() < 0.5:
+        slot = f"{slot} ({rng.randint(0, 9)} left)"
+    return {
+        "phone": rng.choice(phones + [""]),
+        "email": (rng.choice(emails + [""]) if with_email else None),
+        "slot": slot,
+        "status": ""
+    }
+
+
+def run_scenario(seed, max_rows):
+    rng = random.Random(seed)
+    slots = [f"slot{n}" for n in range(1, rng.randint(2, 6))]
+    with_email = rng.random() < 0.9
+    legacy_rows = []
+    incremental_rows = []
+    index = IncrementalIndex(slots, max_bytes=300 if seed % 2 else INDEX_MAX_BYTES)
+    mismatches = []
+
+    for step in range(rng.randint(1, max_rows)):
+        if legacy_rows and rng.random() < 0.05:
+            # Cancellation from the dashboard; the script only sees it on
+            # reconciliation (hourly trigger or Refresh Slots).
+            victim = rng.randrange(len(legacy_rows))
+            legacy_rows[victim]["status"] = "Cancelled"
+            incremental_rows[victim]["status"] = "Cancelled"
+            index.reconcile(incremental_rows)
+        else:
+            submission = random_submission(rng, slots, with_email)
+            legacy_rows.append(dict(submission))
+            incremental_rows.append(dict(submission))
+            legacy_on_form_submit(legacy_rows)
+            index.on_form_submit(incremental_rows)
+
+        expected = {s: c for s, c in legacy_refresh_slots(legacy_rows).items() if s in slots}
+        if expected != index.counts():
+            mismatches.append((seed, step, "counts", expected, index.counts()))
+        statuses = [r["status"] for r in legacy_rows]
+        if statuses != [r["status"] for r in incremental_rows]:
+            mismatches.append((seed, step, "statuses", None, None))
+    return len(legacy_rows), mismatches
+
+
+def main(argv):
+    scenarios = int(argv[1]) if len(argv) > 1 else 200
+    max_rows = int(argv[2]) if len(argv) > 2 else 300
+    total_rows = 0
+    mismatches = []
+    for seed in range(scenarios):
+        rows, found = run_scenario(seed, max_rows)
+        total_rows += rows
+        mismatches.extend(found)
+
+    for seed, step, kind, expected, actual in mismatches[:20]:
+        print(f"seed {seed} step {step}: {kind} differ {expected} != {actual}")
+    print(f"{scenarios} scenarios, {total_rows} submissions, {len(mismatches)} mismatches")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
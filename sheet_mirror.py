@@ -0,0 +1,297 @@
+import json
+import os
+import time
+
+import metadata_store
+from google_clients import get_service, execute
+
+
+# How stale a mirror may be before a read triggers an incremental sync
+MIRROR_MAX_AGE_SECONDS = float(os.environ.get("MIRROR_MAX_AGE_SECONDS", "60"))
+# Appended rows are cheap to pick up, but edits to existing rows (e.g. a
+# "Duplicate" status written by the Apps Script) are only seen on a full pass.
+MIRROR_FULL_RESYNC_SECONDS = float(os.environ.get("MIRROR_FULL_RESYNC_SECONDS", "3600"))
+MIRROR_CHUNK_ROWS = int(os.environ.get("MIRROR_CHUNK_ROWS", "1000"))
+# Chunks fetched per batchGet: a cold sync of 50k rows is five calls, not 50
+MIRROR_CHUNKS_PER_CALL = int(os.environ.get("MIRROR_CHUNKS_PER_CALL", "10"))
+PHONE_HEADER = "Mobile Number"
+STATUS_HEADER = "Status"
+
+metadata_store.register_schema("""
+CREATE TABLE IF NOT EXISTS sheet_mirror (
+    sheet_id TEXT PRIMARY KEY,
+    tab_title TEXT NOT NULL,
+    headers TEXT NOT NULL,
+    row_count INTEGER NOT NULL,
+    revision INTEGER NOT NULL DEFAULT 0,
+    synced_at REAL NOT NULL,
+    full_synced_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sheet_rows (
+    sheet_id TEXT NOT NULL,
+    row_number INTEGER NOT NULL,
+    cells TEXT NOT NULL,
+    PRIMARY KEY (sheet_id, row_number)
+);
+CREATE TABLE IF NOT EXISTS sheet_phone_index (
+    sheet_id TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    row_number INTEGER NOT NULL,
+    PRIMARY KEY (sheet_id, phone, row_number)
+);
+""")
+
+
+def quote_tab(title):
+    return "'" + title.replace("'", "''") + "'"
+
+
+def column_letter(index):
+    # 0-based column index to A1 letters: 0 -> A, 25 -> Z, 26 -> AA
+    letters = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def normalize_phone(value):
+    return str(value).strip()
+
+
+def get_state(sheet_id):
+    row = metadata_store.connect().execute(
+        "SELECT * FROM sheet_mirror WHERE sheet_id = ?", (sheet_id,)
+    ).fetchone()
+    if not row:
+        return None
+    state = dict(row)
+    state["headers"] = json.loads(state["headers"])
+    return state
+
+
+def _fetch_tab_title(sheets_service, sheet_id):
+    spreadsheet = execute(sheets_service.spreadsheets().get(
+        spreadsheetId=sheet_id,
+        fields="sheets.properties.title"
+    ))
+    return spreadsheet["sheets"][0]["properties"]["title"]
+
+
+def _mirrored_row(sheet_id, row_number):
+    row = metadata_store.connect().execute(
+        "SELECT cells FROM sheet_rows WHERE sheet_id = ? AND row_number = ?", (sheet_id, row_number)
+    ).fetchone()
+    return json.loads(row["cells"]) if row else None
+
+
+def _booking_cells(cells, headers):
+    # Status is left out: the script and the app edit it in place
+    cells = list(cells)
+    if STATUS_HEADER in headers and headers.index(STATUS_HEADER) < len(cells):
+        cells[headers.index(STATUS_HEADER)] = ""
+    while cells and cells[-1] == "":
+        cells.pop()
+    return cells
+
+
+def sync_sheet(creds, sheet_id, full=False):
+    sheets_service = get_service(creds, "sheets", "v4")
+    state = get_state(sheet_id)
+    now = time.time()
+    if state and not full and now - state["full_synced_at"] > MIRROR_FULL_RESYNC_SECONDS:
+        full = True
+
+    tab_title = state["tab_title"] if state else _fetch_tab_title(sheets_service, sheet_id)
+    tab = quote_tab(tab_title)
+    start = 2 if full or not state else state["row_count"] + 1
+    headers = state["headers"] if state else []
+    # An incremental pass re-reads the last mirrored row: if it no longer
+    # holds the same booking, rows were deleted or sorted in Sheets and the
+    # mirror's row numbers can't be trusted.
+    overlap = _mirrored_row(sheet_id, start - 1) if start > 2 else None
+    changed = False
+    first = True
+
+    while True:
+        chunk_starts = [start + k * MIRROR_CHUNK_ROWS for k in range(MIRROR_CHUNKS_PER_CALL)]
+        end = chunk_starts[-1] + MIRROR_CHUNK_ROWS - 1
+        ranges = [f"{tab}!{chunk}:{chunk + MIRROR_CHUNK_ROWS - 1}" for chunk in chunk_starts]
+        if first:
+            # Header row rides along with the first call so new columns are seen
+            first_row = start - 1 if overlap is not None else start
+            ranges = [f"{tab}!1:1", f"{tab}!{first_row}:{start + MIRROR_CHUNK_ROWS - 1}"] + ranges[1:]
+        result = execute(sheets_service.spreadsheets().values().batchGet(
+            spreadsheetId=sheet_id,
+            ranges=ranges
+        ))
+        chunks = [value_range.get("values", []) for value_range in result.get("valueRanges", [])]
+        if first:
+            header_values = chunks.pop(0) or [[]]
+            if header_values[0] != headers:
+                headers = header_values[0]
+                changed = True
+            first = False
+            if overlap is not None and chunks:
+                current = chunks[0].pop(0) if chunks[0] else []
+                if _booking_cells(current, headers) != _booking_cells(overlap, headers):
+                    return sync_sheet(creds, sheet_id, full=True)
+        # A short chunk is the end of the sheet
+        rows = []
+        for chunk in chunks:
+            rows.extend(chunk)
+            if len(chunk) < MIRROR_CHUNK_ROWS:
+                break
+        phone_col = headers.index(PHONE_HEADER) if PHONE_HEADER in headers else -1
+
+        with metadata_store.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO sheet_rows (sheet_id, row_number, cells) VALUES (?, ?, ?)",
+                [(sheet_id, start + i, json.dumps(row)) for i, row in enumerate(rows)]
+            )
+            conn.execute(
+                "DELETE FROM sheet_phone_index WHERE sheet_id = ? AND row_number BETWEEN ? AND ?",
+                (sheet_id, start, end)
+            )
+            if phone_col != -1:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO sheet_phone_index (sheet_id, phone, row_number) VALUES (?, ?, ?)",
+                    [
+                        (sheet_id, normalize_phone(row[phone_col]), start + i)
+                        for i, row in enumerate(rows) if len(row) > phone_col and row[phone_col]
+                    ]
+                )
+        if rows:
+            changed = True
+        if len(rows) < MIRROR_CHUNK_ROWS * MIRROR_CHUNKS_PER_CALL:
+            last_row = start + len(rows) - 1
+            break
+        start = end + 1
+
+    with metadata_store.transaction() as conn:
+        if full:
+            deleted = conn.execute(
+                "DELETE FROM sheet_rows WHERE sheet_id = ? AND row_number > ?", (sheet_id, last_row)
+            ).rowcount
+            conn.execute(
+                "DELETE FROM sheet_phone_index WHERE sheet_id = ? AND row_number > ?", (sheet_id, last_row)
+            )
+            changed = changed or deleted > 0
+        conn.execute(
+            """
+            INSERT INTO sheet_mirror (sheet_id, tab_title, headers, row_count, revision, synced_at, full_synced_at)
+            VALUES (?, ?, ?, ?, 1, ?, ?)
+            ON CONFLICT(sheet_id) DO UPDATE SET
+                tab_title = excluded.tab_title,
+                headers = excluded.headers,
+                row_count = excluded.row_count,
+                revision = sheet_mirror.revision + ?,
+                synced_at = excluded.synced_at,
+                full_synced_at = CASE WHEN ? THEN excluded.full_synced_at ELSE sheet_mirror.full_synced_at END
+            """,
+            (sheet_id, tab_title, json.dumps(headers), last_row, now, now, int(changed), full)
+        )
+    return get_state(sheet_id)
+
+
+def ensure_fresh(creds, sheet_id, max_age=None):
+    if max_age is None:
+        max_age = MIRROR_MAX_AGE_SECONDS
+    state = get_state(sheet_id)
+    if state is None or time.time() - state["synced_at"] > max_age:
+        state = sync_sheet(creds, sheet_id)
+    return state
+
+
+def iter_rows(sheet_id, batch_size=500):
+    cursor = metadata_store.connect().execute(
+        "SELECT row_number, cells FROM sheet_rows WHERE sheet_id = ? ORDER BY row_number", (sheet_id,)
+    )
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        for row in batch:
+            yield row["row_number"], json.loads(row["cells"])
+
+
+def find_rows(sheet_id, phones):
+    conn = metadata_store.connect()
+    found = {}
+    for phone in phones:
+        rows = conn.execute(
+            """
+            SELECT r.row_number, r.cells FROM sheet_phone_index i
+            JOIN sheet_rows r ON r.sheet_id = i.sheet_id AND r.row_number = i.row_number
+            WHERE i.sheet_id = ? AND i.phone = ?
+            ORDER BY r.row_number
+            """,
+            (sheet_id, normalize_phone(phone))
+        ).fetchall()
+        if rows:
+            found[phone] = [(row["row_number"], json.loads(row["cells"])) for row in rows]
+    return found
+
+
+def find_rows_by_cell(sheet_id, col, value):
+    # Unindexed: one pass over the sheet's rows inside SQLite, case-insensitive
+    rows = metadata_store.connect().execute(
+        """
+        SELECT row_number, cells FROM sheet_rows
+        WHERE sheet_id = ? AND lower(trim(json_extract(cells, ?))) = ?
+        ORDER BY row_number
+        """,
+        (sheet_id, f"$[{col}]", str(value).strip().lower())
+    ).fetchall()
+    return [(row["row_number"], json.loads(row["cells"])) for row in rows]
+
+
+def lookup_phones(creds, sheet_id, phones, max_age=None):
+    if max_age is None:
+        max_age = MIRROR_MAX_AGE_SECONDS
+    state = get_state(sheet_id)
+    synced = False
+    if state is None or time.time() - state["synced_at"] > max_age:
+        state = sync_sheet(creds, sheet_id)
+        synced = True
+    found = find_rows(sheet_id, phones)
+    if not synced and len(found) < len(set(phones)):
+        # A miss may just be a booking newer than the mirror: pull appended
+        # rows once, never more than one read per lookup.
+        state = sync_sheet(creds, sheet_id)
+        found = find_rows(sheet_id, phones)
+    return state, found
+
+
+def set_cell(sheet_id, row_number, col, value):
+    # Write-through for changes the app itself makes to the sheet
+    with metadata_store.transaction() as conn:
+        row = conn.execute(
+            "SELECT cells FROM sheet_rows WHERE sheet_id = ? AND row_number = ?", (sheet_id, row_number)
+        ).fetchone()
+        if not row:
+            return
+        cells = json.loads(row["cells"])
+        cells.extend([""] * (col + 1 - len(cells)))
+        cells[col] = value
+        conn.execute(
+            "UPDATE sheet_rows SET cells = ? WHERE sheet_id = ? AND row_number = ?",
+            (json.dumps(cells), sheet_id, row_number)
+        )
+        conn.execute("UPDATE sheet_mirror SET revision = revision + 1 WHERE sheet_id = ?", (sheet_id,))
+
+
+def set_headers(sheet_id, headers):
+    with metadata_store.transaction() as conn:
+        conn.execute(
+            "UPDATE sheet_mirror SET headers = ?, revision = revision + 1 WHERE sheet_id = ?",
+            (json.dumps(headers), sheet_id)
+        )
+
+
+def drop_sheet(sheet_id):
+    with metadata_store.transaction() as conn:
+        conn.execute("DELETE FROM sheet_rows WHERE sheet_id = ?", (sheet_id,))
+        conn.execute("DELETE FROM sheet_phone_index WHERE sheet_id = ?", (sheet_id,))
+        conn.execute("DELETE FROM sheet_mirror WHERE sheet_id = ?", (sheet_id,))
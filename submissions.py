@@ -0,0 +1,117 @@
+import threading
+from datetime import datetime
+
+import sheet_mirror
+
+
+SLOT_HEADER = "Choose a Slot"
+STATUS_HEADER = "Status"
+TIMESTAMP_HEADER = "Timestamp"
+# How Google Forms writes the Timestamp column (day first)
+TIMESTAMP_FORMAT = "%d/%m/%Y %H:%M:%S"
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Parsed tables are reused until the mirror revision for the sheet moves
+_cache_lock = threading.Lock()
+_table_cache = {}
+
+
+def normalize_slot(raw):
+    return str(raw or "").strip().split(" (")[0].strip()
+
+
+def normalize_status(raw):
+    return str(raw or "").strip().lower()
+
+
+def timestamp_key(value):
+    # Day-first text doesn't sort by time; reorder it year first. Cells that
+    # don't parse sort before every real timestamp.
+    text = str(value or "").strip()
+    if len(text) == 19 and text[2] == "/" and text[5] == "/":
+        return text[6:10] + text[3:5] + text[0:2] + text[10:]
+    try:
+        return datetime.strptime(text, TIMESTAMP_FORMAT).strftime("%Y%m%d %H:%M:%S")
+    except ValueError:
+        return ""
+
+
+def build_table(headers, rows):
+    columns = list(headers)
+    if STATUS_HEADER not in columns:
+        columns.append(STATUS_HEADER)
+    width = len(columns)
+    slot_col = columns.index(SLOT_HEADER) if SLOT_HEADER in columns else -1
+    status_col = columns.index(STATUS_HEADER)
+
+    # One tuple per row plus parallel columns of the normalized values the
+    # filters and totals need, instead of a dict per submission.
+    records = []
+    slots = []
+    statuses = []
+    for row in rows:
+        cells = tuple(row[:width]) + ("",) * (width - len(row))
+        records.append(cells)
+        slots.append(normalize_slot(cells[slot_col]) if slot_col != -1 else "")
+        statuses.append(normalize_status(cells[status_col]))
+
+    return {"columns": columns, "rows": records, "slots": slots, "statuses": statuses, "sort_keys": {}}
+
+
+def _sort_keys(table, col):
+    # Built once per column and kept with the cached table
+    keys = table["sort_keys"].get(col)
+    if keys is None:
+        key = timestamp_key if table["columns"][col] == TIMESTAMP_HEADER else (lambda value: str(value).lower())
+        keys = table["sort_keys"][col] = [key(row[col]) for row in table["rows"]]
+    return keys
+
+
+def load_table(creds, sheet_id):
+    state = sheet_mirror.ensure_fresh(creds, sheet_id)
+    with _cache_lock:
+        cached = _table_cache.get(sheet_id)
+    if cached and cached[0] == state["revision"]:
+        return cached[1]
+    table = build_table(state["headers"], (cells for _, cells in sheet_mirror.iter_rows(sheet_id)))
+    with _cache_lock:
+        _table_cache[sheet_id] = (state["revision"], table)
+    return table
+
+
+def slot_counts(table, form_slots):
+    counts = {slot: 0 for slot in form_slots}
+    for slot, status in zip(table["slots"], table["statuses"]):
+        if status != "cancelled" and slot in counts:
+            counts[slot] += 1
+    return counts
+
+
+def status_matches(status, wanted):
+    if not wanted:
+        return True
+    if wanted == "active":
+        return status not in ("cancelled", "duplicate")
+    return status == wanted
+
+
+def query(table, slot="", status="", sort="", descending=False, page=1, size=DEFAULT_PAGE_SIZE):
+    size = max(1, min(size, MAX_PAGE_SIZE))
+    indices = [
+        i for i, (row_slot, row_status) in enumerate(zip(table["slots"], table["statuses"]))
+        if (not slot or row_slot == slot) and status_matches(row_status, status)
+    ]
+
+    if sort in table["columns"]:
+        keys = _sort_keys(table, table["columns"].index(sort))
+        indices.sort(key=keys.__getitem__, reverse=descending)
+    elif descending:
+        indices.reverse()
+
+    total = len(indices)
+    pages = max(1, -(-total // size))
+    page = max(1, min(page, pages))
+    start = (page - 1) * size
+    page_rows = [(table["rows"][i], table["statuses"][i]) for i in indices[start:start + size]]
+    return {"rows": page_rows, "total": total, "page": page, "pages": pages, "size": size}
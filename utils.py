@@ -0,0 +1,21 @@
+import json
+import os
+import tempfile
+
+
+def write_json_atomic(path, data):
+    # Write to a temp file and rename so readers never see a half-written
+    # file; fsync first so a crash can't leave an empty one behind.
+    directory = os.path.dirname(path) or "."
+    prefix = "." + os.path.splitext(os.path.basename(path))[0] + "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=prefix, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise